@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter, OrderedDict
+from query_store import STORE_DIR, remove_stale_artifacts, store_path_for
+
+
+# ---------- Query Cache Configs ----------
+CACHE_MAX_ENTRIES = int(os.environ.get("ZOOGIST_QUERY_CACHE_SIZE", "256"))
+CACHE_TTL_SECONDS = int(os.environ.get("ZOOGIST_QUERY_CACHE_TTL", str(7 * 24 * 3600)))
+# Minimum TF-IDF cosine similarity for a near-duplicate question to reuse a cached answer.
+SIMILARITY_THRESHOLD = float(os.environ.get("ZOOGIST_QUERY_CACHE_SIMILARITY", "0.9"))
+
+STOP_WORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "at", "to", "and", "or", "is", "are", "was", "were", "be", "by",
+    "with", "which", "what", "that", "this", "their", "as", "per", "all", "me", "please", "show", "list", "find",
+}
+# Filler words, the only words (besides the stop words) in which near-duplicate questions may differ: any other
+# differing word, e.g. a number, year, species, status, habitat or place, changes the question.
+FILLER_WORDS = {
+    "can", "could", "would", "you", "i", "we", "us", "let", "tell", "give", "want", "like", "know", "kindly",
+    "get", "display", "provide", "return", "do", "does", "did",
+}
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalise_question(question: str) -> str:
+    """Lower-cases the question and strips punctuation & repeated whitespace, used as the exact-match key."""
+    return " ".join(_TOKEN_PATTERN.findall(question.lower()))
+
+
+def _content_tokens(normalised: str) -> list[str]:
+    return [token for token in normalised.split() if token not in STOP_WORDS and token not in FILLER_WORDS]
+
+
+class QueryCache:
+    """LRU/TTL cache of agent responses (generated SQL & final output) keyed by the user question.
+
+    Lookups first try an exact match on the normalised question, then a TF-IDF cosine similarity match
+    over the cached questions to catch near-duplicates, which may only differ in stop & filler words. The cache is
+    bound to a dataset version and is persisted next to the query store so answers survive restarts of the app.
+    """
+
+    def __init__(self, data_path: str, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: int = CACHE_TTL_SECONDS,
+                 similarity_threshold: float = SIMILARITY_THRESHOLD):
+        self.data_path = data_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.dataset_version = None
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.prewarmed = False
+
+    # ----- Dataset versioning & persistence -----
+    @property
+    def _path(self) -> str:
+        return store_path_for(self.data_path, self.dataset_version, suffix="agent-cache.json")
+
+    def ensure_version(self, dataset_version: str):
+        """Drops all entries when the dataset changed, then loads the persisted entries of the new version."""
+        with self._lock:
+            if dataset_version == self.dataset_version:
+                return
+            self.dataset_version = dataset_version
+            self._entries.clear()
+            self.prewarmed = False
+            if os.path.exists(self._path):
+                try:
+                    with open(self._path, encoding="utf-8") as f:
+                        self._entries.update((entry["key"], entry) for entry in json.load(f))
+                    self._evict()
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Could not read the query cache {self._path}: {e}")
+
+    def _persist(self):
+        try:
+            os.makedirs(STORE_DIR, exist_ok=True)
+            tmp_path = f"{self._path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self._entries.values()), f)
+            os.replace(tmp_path, self._path)
+            remove_stale_artifacts(self.data_path, keep=self._path)
+        except OSError as e:
+            logging.warning(f"Could not persist the query cache: {e}")
+
+    def _evict(self):
+        expired = [key for key, entry in self._entries.items() if time.time() - entry["created_at"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # ----- Similarity matching -----
+    def _idf(self) -> dict[str, float]:
+        document_counts = Counter(token for entry in self._entries.values() for token in set(entry["tokens"]))
+        n_documents = len(self._entries) + 1 # +1 accounts for the question being looked up
+        return {token: math.log((1 + n_documents) / (1 + count)) + 1 for token, count in document_counts.items()}
+
+    @staticmethod
+    def _vector(tokens: list[str], idf: dict[str, float], default_idf: float) -> dict[str, float]:
+        return {token: tf * idf.get(token, default_idf) for token, tf in Counter(tokens).items()}
+
+    @staticmethod
+    def _cosine(a: dict[str, float], b: dict[str, float]) -> float:
+        dot = sum(weight * b.get(token, 0.0) for token, weight in a.items())
+        norm = math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values()))
+        return dot / norm if norm else 0.0
+
+    @staticmethod
+    def _same_order(a: list[str], b: list[str]) -> bool:
+        """Whether the tokens shared by both questions appear in the same order (bags of words ignore it, so
+        "Tiger but no Leopard" and "Leopard but no Tiger" would otherwise match)."""
+        shared = set(a) & set(b)
+        return [token for token in a if token in shared] == [token for token in b if token in shared]
+
+    def _most_similar(self, tokens: list[str]) -> tuple[str | None, float]:
+        if not tokens or not self._entries:
+            return None, 0.0
+        idf = self._idf()
+        default_idf = math.log(len(self._entries) + 2) + 1 # Unseen tokens get the highest weight
+        query_vector = self._vector(tokens, idf, default_idf)
+        best_key, best_score = None, 0.0
+        for key, entry in self._entries.items():
+            entry_tokens = _content_tokens(key) # Recomputed so entries persisted with older word lists stay comparable
+            # A high similarity alone also matches "Vulnerable" with "Endangered" or "2021" with "2022" in a long
+            # question: all content words must be shared, only stop & filler words may differ.
+            if set(tokens) != set(entry_tokens) or not self._same_order(tokens, entry_tokens):
+                continue
+            score = self._cosine(query_vector, self._vector(entry_tokens, idf, default_idf))
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key, best_score
+
+    # ----- Public API -----
+    def get(self, question: str) -> dict | None:
+        """Returns the cached response for the question (or a near-duplicate of it), or `None`."""
+        key = normalise_question(question)
+        with self._lock:
+            self._evict()
+            match = "exact"
+            if key not in self._entries:
+                key, score = self._most_similar(_content_tokens(key))
+                if key is None or score < self.similarity_threshold:
+                    return None
+                match = f"similar ({score:.2f})"
+            self._entries.move_to_end(key)
+            entry = self._entries[key]
+        logging.info(f"Query cache hit [{match}]: {question!r} -> {entry['question']!r}")
+        return {"input": question, "output": entry["output"], "sql_queries": entry["sql_queries"], "cache_match": match}
+
+    def put(self, question: str, response: dict):
+        """Stores the SQL queries generated by the agent and its final output for the question."""
+        key = normalise_question(question)
+        with self._lock:
+            self._entries[key] = {
+                "key": key,
+                "question": question,
+                "tokens": _content_tokens(key),
+                "output": response["output"],
+                "sql_queries": extract_sql_queries(response),
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            self._evict()
+            self._persist()
+
+    def carry_over(self, dataset_version: str, is_still_valid) -> int:
+        """Moves the entries still valid after a data change (`is_still_valid(entry)`) to the new dataset version,
+        instead of dropping the whole cache. Returns the number of kept entries."""
+        with self._lock:
+            kept = [(key, entry) for key, entry in self._entries.items() if is_still_valid(entry)]
+            self.dataset_version = dataset_version
+            self._entries = OrderedDict(kept)
+            self.prewarmed = False
+            self._persist()
+        return len(kept)
+
+    def __contains__(self, question: str) -> bool:
+        return normalise_question(question) in self._entries
+
+
+def extract_sql_queries(response: dict) -> list[str]:
+    """Returns the SQL queries passed to the `execute_sql_query` tool during an agent run."""
+    if "sql_queries" in response:
+        return response["sql_queries"]
+    queries = []
+    for action, _ in response.get("intermediate_steps", []):
+        if action.tool != "execute_sql_query":
+            continue
+        tool_input = action.tool_input
+        queries.append(tool_input.get("sql_query", str(tool_input)) if isinstance(tool_input, dict) else str(tool_input))
+    return queries
+
+
+def is_cacheable(response: dict) -> bool:
+    """Only complete answers whose SQL queries all succeeded are cached (retries after errors stay possible)."""
+    output = response.get("output") or ""
+    if not output or output.startswith("Agent stopped"):
+        return False
+    for _, observation in response.get("intermediate_steps", []):
+        if isinstance(observation, dict) and str(observation.get("message", "")).startswith("Error"):
+            return False
+    return True
@@ -0,0 +1,95 @@
+import os
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Callable
+
+
+# ---------- Agent Runner Configs ----------
+MAX_CONCURRENT_RUNS = int(os.environ.get("ZOOGIST_MAX_CONCURRENT_RUNS", "4"))
+MAX_QUEUED_RUNS = int(os.environ.get("ZOOGIST_MAX_QUEUED_RUNS", "16"))
+SESSION_CONCURRENCY = int(os.environ.get("ZOOGIST_SESSION_CONCURRENCY", "1"))
+RUN_TIMEOUT_SECONDS = float(os.environ.get("ZOOGIST_RUN_TIMEOUT", "90"))
+SQL_WORKERS = int(os.environ.get("ZOOGIST_SQL_WORKERS", "4"))
+
+
+class AgentQueueFullError(RuntimeError):
+    """Raised when the job queue of the runner is full."""
+
+
+class AgentRunner:
+    """Runs agent jobs on an asyncio event loop living in a background thread, so slow LLM calls of one
+    session neither block other sessions nor the Streamlit script threads.
+
+    - At most `max_concurrent` jobs run at the same time, further jobs wait (up to `max_queued` in total).
+    - Every session runs at most `session_concurrency` jobs: submitting a new question cancels the oldest
+      job of the session, while re-submitting a question that is still running attaches to that job.
+    - Jobs are cancelled after `timeout` seconds.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RUNS, max_queued: int = MAX_QUEUED_RUNS,
+                 session_concurrency: int = SESSION_CONCURRENCY, timeout: float = RUN_TIMEOUT_SECONDS):
+        self.max_queued = max_queued
+        self.session_concurrency = session_concurrency
+        self.timeout = timeout
+        self.sql_executor = concurrent.futures.ThreadPoolExecutor(max_workers=SQL_WORKERS, thread_name_prefix="sql-tool")
+        self._loop = asyncio.new_event_loop()
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._jobs: dict[str, list[tuple[str, concurrent.futures.Future]]] = {}
+        self._background: list[concurrent.futures.Future] = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop.run_forever, name="agent-runner", daemon=True).start()
+
+    async def _run(self, job: Callable[[], Awaitable[Any]]):
+        async with self._slots:
+            return await asyncio.wait_for(job(), timeout=self.timeout)
+
+    def _active_jobs(self) -> int:
+        return sum(len(jobs) for jobs in self._jobs.values())
+
+    def submit(self, session_id: str, job_key: str, job: Callable[[], Awaitable[Any]]) -> concurrent.futures.Future:
+        """Schedules the coroutine returned by `job` for the session and returns a future of its result."""
+        with self._lock:
+            # Forget finished jobs (and sessions without running jobs)
+            self._jobs = {sid: running for sid, jobs in self._jobs.items() if (running := [job for job in jobs if not job[1].done()])}
+            session_jobs = self._jobs.get(session_id, [])
+            for key, future in session_jobs:
+                if key == job_key:
+                    return future
+            while len(session_jobs) >= self.session_concurrency:
+                key, future = session_jobs.pop(0)
+                future.cancel()
+                logging.info(f"Cancelled agent job {key!r} of session {session_id} (superseded by a new question)")
+            if self._active_jobs() >= self.max_queued:
+                raise AgentQueueFullError("Too many questions are being analysed right now, please try again in a moment.")
+
+            future = asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+            session_jobs.append((job_key, future))
+            self._jobs[session_id] = session_jobs
+        return future
+
+    def submit_background(self, job: Callable[[], Awaitable[Any]]) -> concurrent.futures.Future:
+        """Schedules a background job (e.g. cache pre-warming): it takes a run slot but has no timeout nor session."""
+        async def _run_background():
+            async with self._slots:
+                return await job()
+        future = asyncio.run_coroutine_threadsafe(_run_background(), self._loop)
+        with self._lock:
+            self._background = [job for job in self._background if not job.done()] + [future]
+        return future
+
+    def idle(self) -> bool:
+        """Whether no session nor background job is queued or running."""
+        with self._lock:
+            return all(future.done() for jobs in self._jobs.values() for _, future in jobs) and all(future.done() for future in self._background)
+
+    def cancel_session(self, session_id: str):
+        """Cancels all the running jobs of the session."""
+        with self._lock:
+            for _, future in self._jobs.pop(session_id, []):
+                future.cancel()
+
+    async def run_in_thread(self, func: Callable, *args):
+        """Runs a blocking function (e.g. a SQL query) in the runner's thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.sql_executor, func, *args)
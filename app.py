@@ -1,8 +1,17 @@
-from utils import generate_map, load_and_preprocess_data, create_and_run_agent, prompt
-from datetime import datetime
+from utils import MAP_DETAIL_LEVELS, generate_map, load_and_preprocess_data, load_dataset_summary, load_query_engine, create_and_run_agent, build_prompt
+from utils import load_query_cache, prewarm_query_cache, submit_agent_query, extract_partial_answer, load_chart_data
+from agent_runner import AgentQueueFullError
+from figure_cache import figure_cache
+from concurrent.futures import CancelledError
+from query_store import STREAMING_INGEST, get_query_store, file_content_hash, table_name_for
+from datasets import DEFAULT_DATASET, dataset_label, discover_datasets
+from metrics import METRICS_ENABLED, metrics, trace_stage
 import streamlit as st
-import plotly.express as px
 import json
+import uuid
+import queue
+import time
+import logging
 
 st.set_page_config(
    page_title="Zoogist Insights",
@@ -49,7 +58,22 @@ def about():
 
 
 # ---------------------- Data Loading -------------------
-mammals_df = load_and_preprocess_data("01-mammals-data-final.csv")
+script_started = time.perf_counter()
+datasets = discover_datasets() # Taxa datasets sharing the observatory schema, each one is only loaded once selected
+dataset_name = st.sidebar.selectbox("Dataset:", list(datasets), key="dataset")
+DATA_PATH = datasets[dataset_name]
+table_name = table_name_for(DATA_PATH)
+dataset_version = file_content_hash(DATA_PATH) # Reloads the data only when the CSV contents change
+if STREAMING_INGEST:
+    # Large exports: the records only live in the query store, the app keeps the summary aggregates
+    dataset_summary = load_and_preprocess_data(DATA_PATH, dataset_version, streaming=True)
+    dataset_df = None
+    db_path = dataset_summary["db_path"]
+else:
+    dataset_df = load_and_preprocess_data(DATA_PATH, dataset_version)
+    db_path = get_query_store(DATA_PATH, dataset_df) # Built once per dataset version, reused across reruns & sessions
+    dataset_summary = load_dataset_summary(db_path, table_name)
+query_engine = load_query_engine(db_path, dataset_df, table_name=table_name) # Engine set through the ZOOGIST_QUERY_ENGINE env variable (sqlite/duckdb)
 
 # ---------------------- Chat UI -------------------
 # APP TITLE
@@ -82,15 +106,13 @@ with st.sidebar:
     container.write("Metrics for generating charts 🔽")
     
     # Select boxes
-    x_axis_options = mammals_df.columns.tolist()
-    y_axis_options = mammals_df.columns.tolist()
+    x_axis_options = dataset_summary["columns"]
+    y_axis_options = dataset_summary["columns"]
     chart_type_options = ['bar_chart', 'pie_chart', 'line_chart', 'scatter_plot']
 
     
     # Multi-Select option for the `habitat`` column
-    filter_options = {
-        "habitat": mammals_df["habitat"].unique().tolist()
-    }
+    filter_options = dataset_summary["filter_options"]
     filter_selected_options = {}
             
     # Create Columns for the select boxes
@@ -100,7 +122,7 @@ with st.sidebar:
     color_col = container.selectbox("Select Color (Optional):", [None] + x_axis_options, key = "color_col")
 
     for filter_name, options in filter_options.items():
-        filter_selected_options[filter_name] = container.multiselect(f"Select {filter_name} (Optional):", options = options, key = f"filter_options_{filter_name}")
+        filter_selected_options[filter_name] = container.multiselect(f"Select {filter_name} (Optional):", options = options, key = f"filter_options_{table_name}_{filter_name}")
 
     px_chart = container.button("📊 Visualize Chart")
 
@@ -122,10 +144,15 @@ if 'user_query' not in st.session_state:
     st.session_state['user_query'] = ""
 if 'selected_query' not in st.session_state:
     st.session_state['selected_query'] = demo_queries[0] # Default to first demo query
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex # Identifies the session's jobs in the agent runner
 
 
 # ----------------- Displays the Species Observation Map -----------------
-generate_map(mammals_df)
+map_level = st.select_slider("Map detail:", options=list(MAP_DETAIL_LEVELS), value="overview",
+                             help="Observations are grouped into grid cells, pick a finer level to zoom in (down to single locations).")
+with trace_stage("map_render", level=map_level):
+    generate_map(DATA_PATH, dataset_version, db_path, map_level)
 st.write('---')
 
 # ----------------- Selectbox for queries -----------------
@@ -145,7 +172,14 @@ query_run = st.button("Run Query")
 
 
 # -------------------- Agent initialization & Results generation --------------------
-agent_executor = create_and_run_agent(mammals_df, prompt) # Pass prompt here
+def get_agent():
+    """One agent per dataset, with a system prompt generated from the dataset's table & columns.
+
+        Built on the first question (and by the pre-warming job it starts), not on the first page load.
+    """
+    return create_and_run_agent(query_engine, build_prompt(table_name, dataset_label(DATA_PATH).lower(), dataset_summary["columns"]))
+
+query_cache = load_query_cache(DATA_PATH, dataset_version) # Shared across sessions, reset when the dataset changes
 
 def display_results(agent_response):
     """Displays LLM responses and handles visualization based on the LLM output."""
@@ -153,7 +187,8 @@ def display_results(agent_response):
     try:
         # Attempt to parse the JSON object
         try:
-            output = json.loads(agent_response["output"])
+            with trace_stage("json_parse"):
+                output = json.loads(agent_response["output"])
             st.session_state['output'] = output
             st.session_state['summary_text'] = output.get('summary', output.get('answer', None))
 
@@ -168,40 +203,70 @@ def display_results(agent_response):
         st.error(f"An error occurred: {e}")
 
 
-def plot_chart(df, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options):
+def stream_agent_events(future, events, status, answer_placeholder):
+    """Renders the agent's intermediate steps (SQL, row count, SQL time) and the answer tokens as they arrive."""
+    streamed_text = ""
+    while not (future.done() and events.empty()):
+        try:
+            kind, payload = events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+        if kind == "sql":
+            status.update(label="Running the generated SQL query...")
+            status.code(payload, language="sql")
+        elif kind == "sql_result":
+            status.write(f"`{payload['tool']}` returned **{payload['row_count']}** rows in {payload['seconds'] * 1000:.0f} ms")
+        elif kind == "llm_start":
+            streamed_text = "" # Only the tokens of the latest LLM call make up the answer
+            status.update(label="Waiting for the AI assistant...")
+        elif kind == "token":
+            streamed_text += payload
+            partial_answer = extract_partial_answer(streamed_text)
+            if partial_answer:
+                status.update(label="Writing the response...")
+                answer_placeholder.markdown(f"### **AI Assistant Response 🤖**\n{partial_answer}")
+        elif kind == "cached":
+            status.write(f"Answer served from the query cache ({payload} match)")
+
+
+def build_chart(engine, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options):
+    """Builds the figure of user-selected parameters for definitive chart options."""
+    import plotly.express as px # Only imported once a chart is requested (faster cold starts)
+    started = time.perf_counter()
+
+    # Filters & group-by aggregations run in the query engine, only the aggregated points reach Plotly
+    chart_df, x_axis_col, y_axis_col = load_chart_data(engine, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options)
+    if color_col == 'date':
+        color_col = 'year'
+    color = color_col if color_col in chart_df.columns else None
+
+    if chart_type == 'bar_chart':
+         fig = px.bar(chart_df, x=x_axis_col, y=y_axis_col, color = color, title = "Interactive Bar Chart")
+    elif chart_type == 'pie_chart':
+         fig = px.pie(chart_df, names=x_axis_col, values=y_axis_col, title = "Interactive Pie Chart")
+    elif chart_type == 'line_chart':
+         fig = px.line(chart_df, x=x_axis_col, y=y_axis_col, title = "Interactive Line Chart")
+    elif chart_type == 'scatter_plot':
+         fig = px.scatter(chart_df, x=x_axis_col, y=y_axis_col, color = color, render_mode = "webgl", title = "Interactive Scatter Plot")
+    else:
+         raise ValueError("Invalid Chart Type Selected!")
+    logging.info(f"Chart {chart_type} ({x_axis_col}, {y_axis_col}): {len(chart_df)} points, "
+                 f"{len(fig.to_json()) / 1024:.1f} KB payload, built in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return fig
+
+
+def plot_chart(engine, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options):
     """Function to handle the plotting of user-selected parameters for definitive chart options."""
     try:
-         
-        # Apply filters
-        filtered_df = df.copy()
-        for filter_name, selected_values in filter_selected_options.items():
-           if selected_values:
-               filtered_df = filtered_df[filtered_df[filter_name].isin(selected_values)]
-
-        # Extract year from date column if selected in the x-axis
-        if x_axis_col == 'date':
-            # Convert date strings to datetime objects explicitly
-            filtered_df['year'] = filtered_df['date'].apply(lambda x: datetime.strptime(x, '%d-%m-%Y').year if isinstance(x, str) else x.year)
-            x_axis_col = 'year'  # Update x-axis to be year for plotting
-        if y_axis_col == 'date':
-            filtered_df['year'] = filtered_df['date'].apply(lambda x: datetime.strptime(x, '%d-%m-%Y').year if isinstance(x, str) else x.year)
-            y_axis_col = 'year'
-
-        if y_axis_col and x_axis_col:
-             if chart_type == 'bar_chart':
-                  fig = px.bar(filtered_df, x=x_axis_col, y=y_axis_col, color = color_col, title = "Interactive Bar Chart")
-             elif chart_type == 'pie_chart':
-                  fig = px.pie(filtered_df, names=x_axis_col, values=y_axis_col, title = "Interactive Pie Chart")
-             elif chart_type == 'line_chart':
-                  fig = px.line(filtered_df, x=x_axis_col, y=y_axis_col, title = "Interactive Line Chart")
-             elif chart_type == 'scatter_plot':
-                  fig = px.scatter(filtered_df, x=x_axis_col, y=y_axis_col, color = color_col, title = "Interactive Scatter Plot")
-             else:
-                   st.error("Invalid Chart Type Selected!")
-                   return
-        else:
+        if not (y_axis_col and x_axis_col):
              st.error("Invalid selection for chart parameters!")
              return
+        # Figures are reused across reruns & sessions for the same dataset version and selections
+        params = {"x": x_axis_col, "y": y_axis_col, "chart_type": chart_type, "color": color_col,
+                  "filters": {col: sorted(values) for col, values in filter_selected_options.items()}}
+        fig = figure_cache.get_or_build(DATA_PATH, dataset_version, "chart", params,
+                                        lambda: build_chart(engine, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options))
         st.plotly_chart(fig)
     except Exception as e:
         st.error(f"Error generating plot based on user input: {e}")
@@ -212,15 +277,44 @@ if __name__ == "__main__":
     if query_run:
         if selected_query or user_query:
             query_to_use = user_query if user_query else selected_query # Use custom query if provided, otherwise use selected
-            with st.spinner("Analyzing the data..."):
-                response = agent_executor.invoke({"input": query_to_use})
-                display_results(response)        
+            status = st.status("Analyzing the data...", expanded=True)
+            answer_placeholder = st.empty()
+            try:
+                if DATA_PATH == DEFAULT_DATASET:
+                    # On the first question, not at startup (it builds the agent): the demo queries are about the mammals dataset
+                    prewarm_query_cache(get_agent, query_cache, demo_queries)
+                # Runs on the shared agent runner (bounded queue & timeout), a new question cancels the previous one
+                events = queue.Queue()
+                future = submit_agent_query(get_agent(), query_cache, query_to_use, st.session_state['session_id'], events)
+                stream_agent_events(future, events, status, answer_placeholder)
+                response = future.result()
+                status.update(label="Analysis complete", state="complete", expanded=False)
+                answer_placeholder.empty() # Replaced by the final (fully parsed) response
+                display_results(response)
+            except AgentQueueFullError as e:
+                status.update(label="Queue full", state="error")
+                st.warning(str(e))
+            except TimeoutError:
+                status.update(label="Timed out", state="error")
+                st.error("The AI assistant took too long to respond, please press the **Run Query** button again.")
+            except CancelledError:
+                status.update(label="Cancelled", state="error")
+                st.warning("The previous question was cancelled.")
     else:
          st.warning("Please enter a query.")
 
     # -------- Plotting the visualizations --------
     if px_chart:
         if x_axis_col and y_axis_col and chart_type:
-            plot_chart(mammals_df, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options)
+            plot_chart(query_engine, x_axis_col, y_axis_col, chart_type, color_col, filter_selected_options)
         else:
-            st.error("Please select valid X-axis, Y-axis and Chart Type.")
\ No newline at end of file
+            st.error("Please select valid X-axis, Y-axis and Chart Type.")
+
+    # -------- Per-stage metrics (ZOOGIST_METRICS=1) --------
+    if METRICS_ENABLED:
+        metrics.observe("script_run", time.perf_counter() - script_started)
+        with st.sidebar.expander("🔧 Debug: pipeline metrics"):
+            st.dataframe(metrics.snapshot(), hide_index=True)
+            st.json(metrics.counters(), expanded=False)
+            st.download_button("Download metrics (Prometheus)", metrics.render(), file_name="metrics.prom", mime="text/plain")
+        metrics.flush()
\ No newline at end of file
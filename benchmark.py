@@ -0,0 +1,253 @@
+"""Offline benchmark of the agent loop.
+
+Runs the demo queries (and optionally a larger generated question corpus) end to end through the LangChain agent,
+using the scripted stand-in LLM, so it needs no network access nor API key. Reports per-stage timings
+(prompt build, LLM, SQL, JSON parse), tool-call & iteration counts, token counts and p50/p95 latencies.
+
+    python benchmark.py --corpus full --repeat 3 --engine duckdb --llm-latency 0.2
+
+With `--startup`, it instead measures the cold start of the app in fresh processes: the import time of `utils` and
+the time to first paint (the first run of `app.py` through Streamlit's AppTest), and checks that the modules only
+needed for questions & charts (LangChain, the Groq client, Plotly Express) are not imported by then, nor by the
+background jobs the first run started.
+
+    python benchmark.py --startup --repeat 5 --max-first-paint-ms 4000
+"""
+import os
+import json
+import math
+import time
+import logging
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from langchain_core.callbacks import BaseCallbackHandler
+
+import llm_providers
+import utils
+from datasets import DEFAULT_DATASET
+from metrics import token_usage
+from query_engines import QUERY_ENGINE
+from query_store import TABLE_NAME, file_content_hash, get_connection, get_query_store
+from result_cache import result_cache
+
+STAGES = ["prompt", "llm", "sql", "json_parse", "total"]
+# Modules that must stay out of the cold start, they are imported on the first question or chart.
+LAZY_MODULES = ["langchain.agents", "langchain_groq", "plotly.express"]
+
+# Runs in a fresh interpreter (so nothing is imported yet), from the app directory.
+STARTUP_PROBE = """
+import sys, json, time
+started = time.perf_counter()
+import utils
+import_seconds = time.perf_counter() - started
+
+from streamlit.testing.v1 import AppTest
+app_test = AppTest.from_file("app.py", default_timeout=300)
+started = time.perf_counter()
+app_test.run()
+first_run_seconds = time.perf_counter() - started
+# Background jobs started by the first run (e.g. pre-warming) may still import modules
+runner = utils.get_agent_runner()
+deadline = time.monotonic() + 300
+while not runner.idle() and time.monotonic() < deadline:
+    time.sleep(0.1)
+print(json.dumps({
+    "import_ms": import_seconds * 1000,
+    "first_run_ms": first_run_seconds * 1000,
+    "first_paint_ms": (import_seconds + first_run_seconds) * 1000,
+    "lazy_modules_loaded": [name for name in %r if name in sys.modules],
+    "exceptions": [str(e.value) for e in app_test.exception],
+}))
+"""
+
+
+class StageTimer(BaseCallbackHandler):
+    """Collects the time spent per pipeline stage, and the tool-call/iteration/token counts of one agent run."""
+
+    def __init__(self):
+        self.timings = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._starts = {}
+
+    def _start(self, run_id, stage: str):
+        self._starts[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id):
+        if run_id in self._starts:
+            stage, started = self._starts.pop(run_id)
+            self.timings[stage] += time.perf_counter() - started
+
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        if kwargs.get("name") == "ChatPromptTemplate":
+            self._start(run_id, "prompt")
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.counts["llm_calls"] += 1
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+        prompt_tokens, completion_tokens = token_usage(response)
+        self.counts["prompt_tokens"] += prompt_tokens
+        self.counts["completion_tokens"] += completion_tokens
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.counts["tool_calls"] += 1
+        self._start(run_id, "sql")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        self.counts["iterations"] += 1
+
+
+def build_corpus(db_path: str, corpus: str) -> list[str]:
+    """Returns the benchmark questions, registering the SQL the scripted LLM should generate for each of them."""
+    questions = list(llm_providers.SCRIPTED_SQL)
+    if corpus == "demo":
+        return questions
+
+    conn = get_connection(db_path)
+    def distinct(column):
+        return [row[0] for row in conn.execute(f'SELECT DISTINCT "{column}" FROM "{TABLE_NAME}" WHERE "{column}" IS NOT NULL ORDER BY 1')]
+    def quoted(value):
+        return value.replace("'", "''")
+
+    templates = [
+        ("speciesName", "Calculate the sum of the count for {} species.",
+         "SELECT SUM(total_count) AS total_count FROM cube_species_habitat_year WHERE speciesName = '{}'"),
+        ("habitat", "Which species were observed most often in the {} habitat?",
+         "SELECT speciesName, SUM(observations) AS observations FROM cube_species_habitat_year WHERE habitat = '{}' GROUP BY speciesName ORDER BY observations DESC"),
+        ("conservationStatus", "How many observations per year have a {} status?",
+         "SELECT year, SUM(observations) AS observations FROM cube_species_habitat_year WHERE conservationStatus = '{}' GROUP BY year"),
+    ]
+    for column, question, sql in templates:
+        for value in distinct(column):
+            llm_providers.SCRIPTED_SQL[question.format(value)] = sql.format(quoted(value))
+            questions.append(question.format(value))
+    return questions
+
+
+def run_question(agent_executor, question: str) -> dict:
+    timer = StageTimer()
+    started = time.perf_counter()
+    response = agent_executor.invoke({"input": question}, config={"callbacks": [timer]})
+
+    # Same parsing as `display_results` in app.py
+    parse_started = time.perf_counter()
+    try:
+        json.loads(response["output"])
+    except json.JSONDecodeError:
+        timer.counts["json_errors"] += 1
+    timer.timings["json_parse"] = time.perf_counter() - parse_started
+    timer.timings["total"] = time.perf_counter() - started
+    return {"question": question, "timings": dict(timer.timings), "counts": dict(timer.counts)}
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(pct / 100 * len(ordered)) - 1, 0)] if ordered else 0.0
+
+
+def report(results: list[dict]) -> dict:
+    summary = {"runs": len(results), "stages_ms": {}, "per_run": {}}
+    for stage in STAGES:
+        values = [result["timings"].get(stage, 0.0) * 1000 for result in results]
+        summary["stages_ms"][stage] = {
+            "mean": sum(values) / len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+        }
+    for count in ["llm_calls", "tool_calls", "iterations", "prompt_tokens", "completion_tokens", "json_errors"]:
+        summary["per_run"][count] = sum(result["counts"].get(count, 0) for result in results) / len(results)
+
+    print(f"\n{len(results)} agent runs")
+    print(f"{'stage':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, stats in summary["stages_ms"].items():
+        print(f"{stage:<12}{stats['mean']:>10.2f}{stats['p50']:>10.2f}{stats['p95']:>10.2f}")
+    print("\nper run: " + ", ".join(f"{count}={value:.2f}" for count, value in summary["per_run"].items()))
+    return summary
+
+
+def measure_startup(repeat: int) -> list[dict]:
+    """Runs the startup probe `repeat` times, each in a new process (the first one may also build the cached artifacts)."""
+    results = []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, "-c", STARTUP_PROBE % LAZY_MODULES], capture_output=True, text=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        if completed.returncode != 0:
+            raise RuntimeError(f"Startup probe failed:\n{completed.stderr[-2000:]}")
+        # The agent (when pre-warming the query cache) may also print to stdout, the measures are on the last JSON line
+        results.append(json.loads([line for line in completed.stdout.splitlines() if line.startswith("{")][-1]))
+    return results
+
+
+def report_startup(results: list[dict]) -> dict:
+    summary = {"runs": len(results), "stages_ms": {}, "lazy_modules_loaded": sorted({name for result in results for name in result["lazy_modules_loaded"]}),
+               "exceptions": [e for result in results for e in result["exceptions"]]}
+    print(f"\n{len(results)} cold starts")
+    print(f"{'stage':<16}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage in ["import_ms", "first_run_ms", "first_paint_ms"]:
+        values = [result[stage] for result in results]
+        summary["stages_ms"][stage] = {"mean": sum(values) / len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+        print(f"{stage.removesuffix('_ms'):<16}{summary['stages_ms'][stage]['mean']:>10.2f}{percentile(values, 50):>10.2f}{percentile(values, 95):>10.2f}")
+    print(f"\nmodules imported at startup that should be lazy: {', '.join(summary['lazy_modules_loaded']) or 'none'}")
+    if summary["exceptions"]:
+        print(f"app exceptions: {summary['exceptions']}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", choices=["demo", "full"], default="demo", help="Demo queries only, or a generated larger corpus")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of runs per question")
+    parser.add_argument("--engine", default=QUERY_ENGINE, help="Query engine: sqlite or duckdb")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated latency (s) of each LLM call")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the SQL result cache between runs")
+    parser.add_argument("--json", help="Writes the per-run results & the summary to this file")
+    parser.add_argument("--startup", action="store_true", help="Measures the import time & time to first paint of the app instead")
+    parser.add_argument("--max-first-paint-ms", type=float, help="With --startup, fails when the p50 time to first paint is above this budget")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    if args.startup:
+        results = measure_startup(args.repeat)
+        summary = report_startup(results)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"summary": summary, "results": results}, f, indent=2)
+        over_budget = args.max_first_paint_ms is not None and summary["stages_ms"]["first_paint_ms"]["p50"] > args.max_first_paint_ms
+        if over_budget or summary["lazy_modules_loaded"] or summary["exceptions"]:
+            sys.exit(1)
+        return
+
+    mammals_df = utils.load_and_preprocess_data(DEFAULT_DATASET, file_content_hash(DEFAULT_DATASET))
+    db_path = get_query_store(DEFAULT_DATASET, mammals_df)
+    engine = utils.load_query_engine(db_path, mammals_df, args.engine)
+    questions = build_corpus(db_path, args.corpus)
+
+    llm_providers.FAKE_LLM_LATENCY = args.llm_latency
+    agent_executor = utils.create_and_run_agent(engine, utils.build_prompt(), llm_provider="fake")
+    agent_executor.verbose = False
+
+    results = []
+    for _ in range(args.repeat):
+        for question in questions:
+            if not args.warm_cache:
+                result_cache.clear()
+            results.append(run_question(agent_executor, question))
+    summary = report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
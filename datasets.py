@@ -0,0 +1,28 @@
+import os
+import glob
+from query_store import table_name_for
+
+
+# ---------- Dataset Registry Configs ----------
+# Observatory exports sharing the schema of the mammals dataset (e.g. `02-birds-data-final.csv`), one per taxon.
+DATASET_PATTERN = os.environ.get("ZOOGIST_DATASETS", "*-data-final.csv")
+DEFAULT_DATASET = "01-mammals-data-final.csv"
+# Number of datasets whose dataframe, query engine & agent stay in memory (least recently used ones are dropped).
+MAX_RESIDENT_DATASETS = int(os.environ.get("ZOOGIST_MAX_RESIDENT_DATASETS", "2"))
+
+
+def dataset_label(data_path: str) -> str:
+    """Returns the display name of a dataset, its taxon (`01-mammals-data-final.csv` -> `Mammals`)."""
+    return table_name_for(data_path).removesuffix("_df").replace("_", " ").title()
+
+
+def discover_datasets(pattern: str = DATASET_PATTERN) -> dict[str, str]:
+    """Returns the available datasets as {label: CSV path}, the default dataset first. Nothing is loaded here."""
+    paths = sorted(glob.glob(pattern), key=lambda path: (os.path.basename(path) != DEFAULT_DATASET, os.path.basename(path)))
+    if not paths and os.path.exists(DEFAULT_DATASET):
+        paths = [DEFAULT_DATASET]
+    datasets = {}
+    for path in paths:
+        label = dataset_label(path)
+        datasets[label if label not in datasets else f"{label} ({os.path.basename(path)})"] = path
+    return datasets
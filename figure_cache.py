@@ -0,0 +1,106 @@
+import os
+import glob
+import json
+import contextlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable
+from metrics import count, trace_stage
+from query_store import remove_stale_artifacts, store_path_for
+
+
+# ---------- Figure Cache Configs ----------
+FIGURE_CACHE_MAX_ENTRIES = int(os.environ.get("ZOOGIST_FIGURE_CACHE_SIZE", "64"))
+FIGURE_CACHE_MAX_FILES = int(os.environ.get("ZOOGIST_FIGURE_CACHE_FILES", "256"))
+
+
+def figure_key(kind: str, params: dict) -> str:
+    """Content hash of a figure's parameters (e.g. the chart columns, type and filters)."""
+    payload = json.dumps({"kind": kind, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class FigureCache:
+    """Two-level cache of built Plotly figures (map & sidebar charts) shared by all sessions.
+
+    Figures are kept in an in-memory LRU and serialised to JSON in a directory per dataset version, so reruns,
+    other sessions and restarts of the app reuse them instead of querying the data and building them again.
+    """
+
+    def __init__(self, max_entries: int = FIGURE_CACHE_MAX_ENTRIES, max_files: int = FIGURE_CACHE_MAX_FILES):
+        self.max_entries = max_entries
+        self.max_files = max_files
+        self._figures: OrderedDict[tuple, object] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _directory(self, data_path: str, dataset_version: str) -> str:
+        return store_path_for(data_path, dataset_version, suffix="figures")
+
+    def _read(self, path: str):
+        # The prebuilt figure is rendered from its JSON dict as is, without rebuilding the figure object (`st.plotly_chart` still imports Plotly)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read the cached figure {path}: {e}")
+            return None
+
+    def _write(self, directory: str, path: str, figure, data_path: str):
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, exist_ok=True)
+                remove_stale_artifacts(data_path, keep=directory)
+            tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(figure.to_json())
+            os.replace(tmp_path, path)
+            files = sorted(glob.glob(os.path.join(directory, "*.json")), key=os.path.getmtime)
+            for old_path in files[:max(len(files) - self.max_files, 0)]:
+                with contextlib.suppress(FileNotFoundError): # Evicted by another thread meanwhile
+                    os.remove(old_path)
+        except OSError as e:
+            logging.warning(f"Could not persist the figure {path}: {e}")
+
+    def get_or_build(self, data_path: str, dataset_version: str, kind: str, params: dict, build: Callable):
+        """Returns the cached figure for the dataset version & parameters, or builds it with `build()` and caches it.
+
+        `build` may return `None` (nothing to plot), which is not cached. Figures read from disk are returned as the
+        JSON dicts of the figures, which `st.plotly_chart` renders like the figures themselves.
+        """
+        key = figure_key(kind, params)
+        memory_key = (os.path.abspath(data_path), dataset_version, key)
+        with self._lock:
+            if memory_key in self._figures:
+                self._figures.move_to_end(memory_key)
+                count("zoogist_cache_requests_total", cache="figure", result="memory")
+                return self._figures[memory_key]
+
+        directory = self._directory(data_path, dataset_version)
+        path = os.path.join(directory, f"{kind}-{key}.json")
+        figure = self._read(path) if os.path.exists(path) else None
+        if figure is None:
+            count("zoogist_cache_requests_total", cache="figure", result="miss")
+            with trace_stage("figure_build", kind=kind):
+                figure = build()
+            if figure is None:
+                return None
+            self._write(directory, path, figure, data_path)
+        else:
+            count("zoogist_cache_requests_total", cache="figure", result="disk")
+            logging.info(f"Figure {kind} {params} loaded from {path}")
+
+        with self._lock:
+            self._figures[memory_key] = figure
+            while len(self._figures) > self.max_entries:
+                self._figures.popitem(last=False)
+        return figure
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+# Process-wide instance shared by all sessions
+figure_cache = FigureCache()
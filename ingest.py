@@ -0,0 +1,164 @@
+"""Appends a batch of new occurrence records to the dataset.
+
+The batch must use the schema of the dataset CSV. Records without coordinates or instanceID are dropped, and
+records whose instanceID is already in the dataset (or repeated within the batch) are skipped. The new records are
+appended to the CSV and to the query store, whose map bins, summary cubes and indexes are updated incrementally; the
+typed Parquet cache and the agent's query cache are carried over to the new dataset version.
+
+    python ingest.py new-observations.csv --data-path 01-mammals-data-final.csv
+"""
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import argparse
+import datetime as dt
+import pandas as pd
+
+from agent_cache import QueryCache
+from datasets import DEFAULT_DATASET
+from query_engines import FETCH_BATCH_ROWS
+from query_store import (COLUMN_TYPES, DATE_FORMAT, STORE_DIR, TIMESTAMP_FORMAT, append_to_store, apply_column_types,
+                         existing_instance_ids, file_content_hash, get_query_store, prepare_chunk, remove_stale_artifacts,
+                         store_path_for, table_name_for)
+
+
+def _csv_line_terminator(data_path: str) -> tuple[str, bool]:
+    """Returns the line terminator of the CSV and whether its last line is terminated."""
+    with open(data_path, "rb") as f:
+        first_line = f.readline()
+        f.seek(max(os.path.getsize(data_path) - 1, 0))
+        ends_with_newline = f.read(1) == b"\n"
+    return ("\r\n" if first_line.endswith(b"\r\n") else "\n"), ends_with_newline
+
+
+def _as_csv_values(rows: pd.DataFrame) -> pd.DataFrame:
+    """Formats parsed `date`/`timestamp` values back to the formats of the dataset CSV."""
+    rows = rows.copy()
+    for col, date_format in [("date", DATE_FORMAT), ("timestamp", TIMESTAMP_FORMAT)]:
+        if col not in rows.columns:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(rows[col]):
+            rows[col] = rows[col].dt.strftime(date_format)
+        else: # Text, or e.g. `datetime.date` objects
+            rows[col] = rows[col].map(lambda value: value.strftime(date_format) if isinstance(value, dt.date) else value, na_action="ignore")
+    return rows
+
+
+def _result_digest(conn: sqlite3.Connection, sql: str) -> str:
+    """Hash of the rows of the query, streamed in batches so large results are never fully materialised."""
+    digest = hashlib.sha1()
+    cursor = conn.execute(sql)
+    while batch := cursor.fetchmany(FETCH_BATCH_ROWS):
+        for row in batch:
+            digest.update(repr(row).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _same_results(old_db: str, new_db: str, sql_queries: list[str]) -> bool:
+    """Whether the queries return the same rows on both versions of the store (errors count as a change)."""
+    old_conn = sqlite3.connect(f"file:{os.path.abspath(old_db)}?mode=ro", uri=True)
+    new_conn = sqlite3.connect(f"file:{os.path.abspath(new_db)}?mode=ro", uri=True)
+    try:
+        return all(_result_digest(old_conn, sql) == _result_digest(new_conn, sql) for sql in sql_queries)
+    except sqlite3.Error:
+        return False
+    finally:
+        old_conn.close()
+        new_conn.close()
+
+
+def _append_to_parquet(data_path: str, old_version: str, new_version: str, records: pd.DataFrame):
+    """Writes the typed Parquet cache of the new version from the previous one, so the app doesn't re-parse the CSV."""
+    old_path = store_path_for(data_path, old_version, suffix="parquet")
+    if not os.path.exists(old_path):
+        return
+    new_path = store_path_for(data_path, new_version, suffix="parquet")
+    try:
+        typed_records = records.copy()
+        for col in [col for col, col_type in COLUMN_TYPES.items() if col_type in ("FLOAT", "INTEGER") and col in typed_records.columns]:
+            typed_records[col] = pd.to_numeric(typed_records[col], errors="coerce")
+        typed_records = apply_column_types(typed_records)
+        df = pd.concat([pd.read_parquet(old_path), typed_records], ignore_index=True)
+        apply_column_types(df).to_parquet(new_path, index=False)
+        remove_stale_artifacts(data_path, keep=new_path)
+    except (ImportError, OSError, ValueError) as e:
+        logging.warning(f"Could not update the Parquet cache, it will be rebuilt from the CSV: {e}")
+
+
+def append_records(data_path: str, records: pd.DataFrame | str) -> dict:
+    """Appends new occurrence records (a dataframe or the path of a CSV file) to the dataset at `data_path`.
+
+        Returns:
+            A summary dict with the number of `received`, `invalid`, `duplicate` and `appended` records, and the
+            resulting `dataset_version` & `db_path`.
+    """
+    if isinstance(records, str):
+        # Values are kept as text, so the rows appended to the CSV are the ones of the batch file
+        records = pd.read_csv(records, dtype=str)
+    records = records.reset_index(drop=True)
+    old_version = file_content_hash(data_path)
+    old_db = get_query_store(data_path)
+    table_name = table_name_for(data_path)
+
+    valid = prepare_chunk(records)
+    unique = valid.drop_duplicates("instanceID")
+    prepared = unique[~unique["instanceID"].isin(existing_instance_ids(old_db, unique["instanceID"].tolist(), table_name))]
+    summary = {
+        "received": len(records),
+        "invalid": len(records) - len(valid),
+        "duplicate": len(valid) - len(prepared),
+        "appended": len(prepared),
+        "dataset_version": old_version,
+        "db_path": old_db,
+    }
+    if prepared.empty:
+        logging.info(f"No new records to append to {data_path}.")
+        return summary
+
+    # The new store is built next to the current one, which keeps serving queries until it is replaced
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = f"{old_db}.append-{os.getpid()}"
+    append_to_store(old_db, prepared, tmp_path, table_name)
+    # Rows are written in the column order of the dataset CSV (which may also have extra columns)
+    new_rows = _as_csv_values(records.loc[prepared.index].reindex(columns=pd.read_csv(data_path, nrows=0).columns))
+    try:
+        terminator, ends_with_newline = _csv_line_terminator(data_path)
+        with open(data_path, "a", encoding="utf-8", newline="") as f:
+            if not ends_with_newline:
+                f.write(terminator)
+            new_rows.to_csv(f, header=False, index=False, lineterminator=terminator)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    new_version = file_content_hash(data_path)
+    new_db = store_path_for(data_path, new_version)
+    os.replace(tmp_path, new_db)
+
+    # Cached answers are only dropped when one of their SQL queries returns different rows on the new records
+    query_cache = QueryCache(data_path)
+    query_cache.ensure_version(old_version)
+    kept = query_cache.carry_over(new_version, lambda entry: _same_results(old_db, new_db, entry["sql_queries"]))
+    _append_to_parquet(data_path, old_version, new_version, new_rows)
+    remove_stale_artifacts(data_path, keep=new_db)
+    logging.info(f"Appended {len(prepared)} records to {data_path} (version {new_version[:16]}), kept {kept} cached answers.")
+
+    summary.update(dataset_version=new_version, db_path=new_db)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("records", help="CSV file with the new occurrence records")
+    parser.add_argument("--data-path", default=DEFAULT_DATASET, help="Dataset CSV the records are appended to")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print(json.dumps(append_records(args.data_path, args.records), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import re
+import json
+import time
+from typing import Any, Iterator
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from agent_cache import normalise_question
+
+
+# ---------- LLM Provider Configs ----------
+# "groq" (default, needs the GROQ_API_KEY secret) or "fake" (deterministic, offline stand-in for benchmarks & tests)
+LLM_PROVIDER = os.environ.get("ZOOGIST_LLM_PROVIDER", "groq").lower()
+GROQ_MODEL = "llama-3.1-8b-instant"
+FAKE_LLM_LATENCY = float(os.environ.get("ZOOGIST_FAKE_LLM_LATENCY", "0"))
+
+# SQL generated by the fake LLM for each (normalised) question. Questions without a script are answered directly.
+SCRIPTED_SQL = {
+    "List all the species and their scientific names, place which has a Endangered status.":
+        "SELECT DISTINCT speciesName, scientificName, place FROM cube_species_place WHERE conservationStatus = 'Endangered'",
+    "Find the habitat were the highest number of least concern species are found.":
+        "SELECT habitat, COUNT(DISTINCT speciesName) AS species_count FROM cube_species_habitat_year WHERE conservationStatus = 'Least Concern' GROUP BY habitat ORDER BY species_count DESC LIMIT 1",
+    "Show the date, place, and the habitat where Tiger species were observed.":
+        "SELECT date, place, habitat FROM mammals_df WHERE speciesName = 'Tiger'",
+    "Calculate the sum of the count for Dhole species.":
+        "SELECT SUM(total_count) AS total_count FROM cube_species_habitat_year WHERE speciesName = 'Dhole'",
+    "Which of the users has recorded the most species with a Near Threatened status?":
+        "SELECT username, COUNT(DISTINCT speciesName) AS species_count FROM cube_user_species WHERE conservationStatus = 'Near Threatened' GROUP BY username ORDER BY species_count DESC LIMIT 1",
+    "Calculate the sum of count for all species with a Vulnerable status and list as per their names.":
+        "SELECT speciesName, SUM(total_count) AS total_count FROM cube_species_habitat_year WHERE conservationStatus = 'Vulnerable' GROUP BY speciesName",
+}
+_ROW_COUNT_PATTERN = re.compile(r"[\"']row_count[\"']: (\d+)")
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Deterministic stand-in for the chat model of the agent.
+
+    On the first turn it calls `execute_sql_query` with the SQL scripted for the question, and once the
+    tool result is in the scratchpad it returns a JSON summary in the format expected by `display_results`.
+    """
+    script: dict[str, str] = {}
+    latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def _script_for(self, question: str) -> str | None:
+        script = {normalise_question(q): sql for q, sql in (self.script or SCRIPTED_SQL).items()}
+        return script.get(normalise_question(question))
+
+    def _reply(self, messages: list[BaseMessage]) -> AIMessage:
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        tool_results = [m.content for m in messages if isinstance(m, ToolMessage)]
+        sql = self._script_for(question)
+
+        if sql is not None and not tool_results:
+            return AIMessage(content="", tool_calls=[{"name": "execute_sql_query", "args": {"__arg1": sql}, "id": "call_0"}])
+        if not tool_results:
+            return AIMessage(content=json.dumps({"answer": "I can only answer questions about the mammals dataset."}))
+
+        row_count = _ROW_COUNT_PATTERN.search(tool_results[-1])
+        rows = int(row_count.group(1)) if row_count else 0
+        summary = f"The query returned {rows} row(s) for the question: {question}"
+        return AIMessage(content=json.dumps({"summary": summary, "chart_type": "bar_chart", "x_axis": None, "y_axis": None}))
+
+    def _usage(self, messages: list[BaseMessage], message: AIMessage) -> dict:
+        # Word counts stand in for tokens
+        input_tokens, output_tokens = sum(len(str(m.content).split()) for m in messages), len(str(message.content).split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        message = self._reply(messages)
+        message.usage_metadata = self._usage(messages, message)
+        usage = {"prompt_tokens": message.usage_metadata["input_tokens"], "completion_tokens": message.usage_metadata["output_tokens"]}
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage, "model_name": self._llm_type})
+
+    def _stream(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        # Tool calls are sent in one chunk, answers word by word (like the token stream of a real model)
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        message = self._reply(messages)
+        if message.tool_calls:
+            tool_call_chunks = [{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i} for i, call in enumerate(message.tool_calls)]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=tool_call_chunks,
+                                                             usage_metadata=self._usage(messages, message)))
+            return
+        for token in re.findall(r"\S+\s*", message.content):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+        # The usage comes last, like in the final chunk of the provider streams
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, message)))
+
+
+def create_llm(provider: str = LLM_PROVIDER):
+    """Creates the chat model of the agent for the given provider."""
+    if provider == "fake":
+        return ScriptedChatModel(latency_seconds=FAKE_LLM_LATENCY)
+    if provider != "groq":
+        raise ValueError(f"Unknown LLM provider '{provider}'. Use 'groq' or 'fake'.")
+
+    from langchain_groq import ChatGroq
+
+    if "GROQ_API_KEY" not in os.environ:
+        import streamlit as st
+        os.environ["GROQ_API_KEY"] = st.secrets["GROQ_API_KEY"]
+    return ChatGroq(model_name=GROQ_MODEL)
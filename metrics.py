@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+
+
+# ---------- Metrics Configs ----------
+# Disabled by default: `trace_stage` is then a shared no-op context manager and no callbacks are attached to the agent.
+METRICS_ENABLED = os.environ.get("ZOOGIST_METRICS", "0") == "1"
+# Prometheus text file (e.g. for the node_exporter textfile collector), rewritten at most every `METRICS_FLUSH_SECONDS`.
+METRICS_FILE = os.environ.get("ZOOGIST_METRICS_FILE", os.path.join(os.environ.get("ZOOGIST_STORE_DIR", ".zoogist_cache"), "metrics.prom"))
+METRICS_FLUSH_SECONDS = float(os.environ.get("ZOOGIST_METRICS_FLUSH", "10"))
+
+STAGE_METRIC = "zoogist_stage_duration_seconds"
+METRIC_HELP = {
+    STAGE_METRIC: "Time spent per pipeline stage.",
+    "zoogist_llm_tokens_total": "Tokens sent to & generated by the LLM.",
+    "zoogist_agent_iterations_total": "Tool-calling iterations of the agent.",
+    "zoogist_sql_rows_total": "Rows returned by the SQL queries of the agent.",
+    "zoogist_cache_requests_total": "Cache lookups per cache and result (hit/miss).",
+}
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe in-process metrics: stage durations (count, sum, max & last value) and counters, both with labels."""
+
+    def __init__(self, path: str = METRICS_FILE, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self._stages = defaultdict(lambda: {"count": 0, "sum": 0.0, "max": 0.0, "last": 0.0})
+        self._counters = defaultdict(float)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Observations come from any thread, one of them writes the file at a time
+        self._flushed_at = time.monotonic()
+
+    def observe(self, stage: str, seconds: float, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            stats = self._stages[key]
+            stats["count"] += 1
+            stats["sum"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["last"] = seconds
+        self._maybe_flush()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def snapshot(self) -> list[dict]:
+        """Returns the stage durations in milliseconds (for the debug panel)."""
+        with self._lock:
+            return [
+                {"stage": stage, **dict(labels), "count": stats["count"], "mean_ms": round(stats["sum"] / stats["count"] * 1000, 2),
+                 "max_ms": round(stats["max"] * 1000, 2), "last_ms": round(stats["last"] * 1000, 2)}
+                for (stage, labels), stats in sorted(self._stages.items())
+            ]
+
+    def counters(self) -> dict[str, float]:
+        with self._lock:
+            return {f"{name}{_labels_text(labels)}": value for (name, labels), value in sorted(self._counters.items())}
+
+    def render(self) -> str:
+        """Returns all the metrics in the Prometheus text exposition format."""
+        lines = [f"# HELP {STAGE_METRIC} {METRIC_HELP[STAGE_METRIC]}", f"# TYPE {STAGE_METRIC} summary"]
+        with self._lock:
+            for (stage, labels), stats in sorted(self._stages.items()):
+                label_text = _labels_text((("stage", stage), *labels))
+                lines.append(f"{STAGE_METRIC}_sum{label_text} {stats['sum']:.6f}")
+                lines.append(f"{STAGE_METRIC}_count{label_text} {stats['count']}")
+            described = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in described:
+                    described.add(name)
+                    lines += [f"# HELP {name} {METRIC_HELP.get(name, name)}", f"# TYPE {name} counter"]
+                lines.append(f"{name}{_labels_text(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def _maybe_flush(self):
+        # Threads observing while another one writes the file don't wait for it
+        if time.monotonic() - self._flushed_at >= self.flush_seconds and self._flush_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._flushed_at >= self.flush_seconds:
+                    self._write()
+            finally:
+                self._flush_lock.release()
+
+    def flush(self):
+        """Writes the metrics file (atomically, so scrapers never read a partial file)."""
+        with self._flush_lock:
+            self._write()
+
+    def _write(self):
+        self._flushed_at = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not write the metrics file {self.path}: {e}")
+
+
+# Process-wide registry shared by all sessions
+metrics = MetricsRegistry()
+
+
+class _StageTrace:
+    __slots__ = ("stage", "labels", "started")
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        metrics.observe(self.stage, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoTrace:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_TRACE = _NoTrace()
+
+
+def trace_stage(stage: str, **labels):
+    """Context manager timing a pipeline stage, e.g. `with trace_stage("sql", engine="duckdb"): ...` (no-op when disabled)."""
+    return _StageTrace(stage, labels) if METRICS_ENABLED else _NO_TRACE
+
+
+def count(name: str, value: float = 1, **labels):
+    """Increments a counter (no-op when disabled)."""
+    if METRICS_ENABLED:
+        metrics.increment(name, value, **labels)
+
+
+def token_usage(response) -> tuple[int, int]:
+    """Returns the (prompt, completion) tokens of an LLM result, from the message usage metadata (also filled when
+    streaming) or else from the provider's `token_usage`."""
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            prompt_tokens += usage.get("input_tokens", 0)
+            completion_tokens += usage.get("output_tokens", 0)
+    if not prompt_tokens and not completion_tokens:
+        usage = (response.llm_output or {}).get("token_usage", {})
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return prompt_tokens, completion_tokens
+
+
+# The callbacks are only defined (and LangChain imported) when metrics are enabled, to keep the app start fast.
+if METRICS_ENABLED:
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class MetricsCallbackHandler(BaseCallbackHandler):
+        """Records the LLM latency & tokens, tool latency and agent iterations of the agent runs."""
+
+        def __init__(self):
+            self._starts = {}
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            self._starts[run_id] = time.perf_counter()
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            if run_id in self._starts:
+                metrics.observe("llm", time.perf_counter() - self._starts.pop(run_id))
+            prompt_tokens, completion_tokens = token_usage(response)
+            metrics.increment("zoogist_llm_tokens_total", prompt_tokens, kind="prompt")
+            metrics.increment("zoogist_llm_tokens_total", completion_tokens, kind="completion")
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._starts.pop(run_id, None)
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self._starts[run_id] = time.perf_counter()
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            if run_id in self._starts:
+                metrics.observe("tool", time.perf_counter() - self._starts.pop(run_id), tool=kwargs.get("name") or "unknown")
+
+        def on_tool_error(self, error, *, run_id, **kwargs):
+            self._starts.pop(run_id, None)
+
+        def on_agent_action(self, action, *, run_id, **kwargs):
+            metrics.increment("zoogist_agent_iterations_total")
+
+
+def agent_callbacks() -> list:
+    """Callbacks to pass in the config of agent runs (none when metrics are disabled)."""
+    return [MetricsCallbackHandler()] if METRICS_ENABLED else []
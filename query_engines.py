@@ -0,0 +1,192 @@
+import os
+import re
+import logging
+import functools
+import pandas as pd
+from query_store import DATE_FORMAT, TABLE_NAME, TIMESTAMP_FORMAT, get_connection, read_summary_cubes
+
+
+# ---------- Query Engine Configs ----------
+# Engine used by `execute_sql_query`: "sqlite" (default, row store) or "duckdb" (columnar, queries the dataframe zero-copy).
+QUERY_ENGINE = os.environ.get("ZOOGIST_QUERY_ENGINE", "sqlite").lower()
+
+# Rows are pulled from the cursor in batches, so large results are never fully materialised.
+FETCH_BATCH_ROWS = 1000
+
+# `strftime('%Y', date)` (SQLite argument order) -> `strftime(CAST(date AS TIMESTAMP), '%Y')` (DuckDB argument order)
+_STRFTIME_PATTERN = re.compile(r"strftime\(\s*('(?:[^']|'')*')\s*,\s*((?:[^(),]|\([^()]*\))+?)\s*\)", re.IGNORECASE)
+_LIKE_PATTERN = re.compile(r"(?<![\w.])(NOT\s+)?LIKE\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+# ISO formats of the date columns (as in the SQLite store), and the raw CSV formats they are parsed from
+_DATE_COLUMNS = {"date": ("%Y-%m-%d", DATE_FORMAT), "timestamp": ("%Y-%m-%d %H:%M:%S", TIMESTAMP_FORMAT)}
+
+
+class QueryEngine:
+    """Common interface of the engines behind `execute_sql_query`. `execute` returns a DB-API like cursor
+    (exposing `description`, `fetchmany` and `fetchall`)."""
+    name = "base"
+
+    def __init__(self, db_path: str, table_name: str = TABLE_NAME):
+        self.db_path = db_path
+        self.table_name = table_name
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.name}:{self.db_path}"
+
+    @functools.cached_property
+    def identifiers(self) -> frozenset[str]:
+        """Lower-cased names of the tables & columns of the store (the DuckDB engine registers the same tables)."""
+        conn = get_connection(self.db_path)
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")]
+        columns = [row[1] for table in tables for row in conn.execute(f'PRAGMA table_info("{table}")')]
+        return frozenset(name.lower() for name in tables + columns)
+
+    def translate(self, query_str: str) -> str:
+        """Rewrites the SQLite dialect used in the system prompt into the engine's dialect."""
+        return query_str
+
+    def execute(self, query_str: str):
+        raise NotImplementedError
+
+
+class SQLiteEngine(QueryEngine):
+    """Row store engine running on the persistent SQLite store (fallback engine)."""
+    name = "sqlite"
+
+    def execute(self, query_str: str):
+        cursor = get_connection(self.db_path).cursor()
+        cursor.execute(self.translate(query_str))
+        return cursor
+
+
+class DuckDBEngine(QueryEngine):
+    """Columnar engine querying the loaded dataframe (and the summary cubes) in place through DuckDB's Arrow integration."""
+    name = "duckdb"
+
+    def __init__(self, db_path: str, df: pd.DataFrame, table_name: str = TABLE_NAME):
+        import duckdb
+
+        super().__init__(db_path, table_name)
+        # The records are queried in place: only the date columns are formatted (as in the SQLite store), by a view
+        self._records = df
+        self._records_frame = f"_{table_name}_frame"
+        date_columns = ", ".join(f'{self._date_sql(df, col)} AS "{col}"' for col in _DATE_COLUMNS if col in df.columns)
+        self._records_view = (f'CREATE TEMP VIEW "{table_name}" AS SELECT * '
+                              + (f"REPLACE ({date_columns}) " if date_columns else "") + f'FROM "{self._records_frame}"')
+        # The (kilobyte-sized) summary cubes precomputed in the SQLite store
+        self._cubes = read_summary_cubes(db_path)
+        # The agent's SQL comes from the user's question: no file, network nor extension access, and the
+        # configuration can't be changed back from SQL.
+        self._conn = duckdb.connect(database=":memory:", config={"enable_external_access": False, "lock_configuration": True})
+
+    @staticmethod
+    def _date_sql(df: pd.DataFrame, col: str) -> str:
+        iso_format, raw_format = _DATE_COLUMNS[col]
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            return f"strftime(\"{col}\", '{iso_format}')"
+        return f"strftime(try_strptime(CAST(\"{col}\" AS VARCHAR), '{raw_format}'), '{iso_format}')"
+
+    def _cursor(self):
+        # DuckDB connections are not thread-safe, so every query gets its own cursor. Registered views are
+        # local to a cursor, hence the (zero-copy) registration of the dataframes on each of them.
+        cursor = self._conn.cursor()
+        cursor.register(self._records_frame, self._records)
+        cursor.execute(self._records_view)
+        for name, frame in self._cubes.items():
+            cursor.register(name, frame)
+        return cursor
+
+    def translate(self, query_str: str) -> str:
+        query_str = _STRFTIME_PATTERN.sub(lambda m: f"strftime(CAST({m.group(2)} AS TIMESTAMP), {m.group(1)})", query_str)
+        # SQLite's LIKE is case-insensitive, DuckDB's is not (string literals are left untouched).
+        parts = _STRING_LITERAL.split(query_str)
+        return "".join(part if i % 2 else _LIKE_PATTERN.sub(lambda m: f"{m.group(1) or ''}ILIKE", part) for i, part in enumerate(parts))
+
+    def execute(self, query_str: str):
+        import duckdb
+
+        query_str = self.translate(query_str)
+        # Read-only, like the SQLite store connections
+        statements = duckdb.extract_statements(query_str)
+        if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+            raise ValueError("Only a single SELECT statement can be executed.")
+        return self._cursor().execute(query_str)
+
+
+def create_query_engine(db_path: str, df: pd.DataFrame | None = None, engine_name: str = QUERY_ENGINE, table_name: str = TABLE_NAME) -> QueryEngine:
+    """Creates the configured query engine, falling back to SQLite when DuckDB is unavailable."""
+    if engine_name == "duckdb":
+        if df is None:
+            logging.warning("DuckDB engine needs the loaded dataframe, falling back to SQLite.")
+        else:
+            try:
+                return DuckDBEngine(db_path, df, table_name)
+            except ImportError:
+                logging.warning("duckdb is not installed, falling back to the SQLite engine.")
+    elif engine_name != "sqlite":
+        logging.warning(f"Unknown query engine '{engine_name}', falling back to SQLite.")
+    return SQLiteEngine(db_path, table_name)
+
+
+# ---------- Bounded result fetching ----------
+class _ColumnStats:
+    """Running statistics of a result column (null count, min/max and mean of numeric values)."""
+
+    def __init__(self):
+        self.nulls = 0
+        self.values = 0
+        self.numeric = 0
+        self.total = 0.0
+        self.min = self.max = None
+        self.comparable = True
+
+    def update(self, value):
+        if value is None:
+            self.nulls += 1
+            return
+        self.values += 1
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            self.numeric += 1
+            self.total += value
+        if self.comparable:
+            try:
+                self.min = value if self.min is None or value < self.min else self.min
+                self.max = value if self.max is None or value > self.max else self.max
+            except TypeError: # Mixed types within a column (SQLite is dynamically typed)
+                self.comparable, self.min, self.max = False, None, None
+
+    def to_dict(self) -> dict:
+        stats = {"nulls": self.nulls, "min": self.min, "max": self.max}
+        if self.values and self.numeric == self.values:
+            stats["mean"] = round(self.total / self.numeric, 4)
+        return stats
+
+
+def run_bounded_query(engine: QueryEngine, query_str: str, max_rows: int) -> tuple[list[str], list[tuple], dict]:
+    """Executes the query and keeps only its first `max_rows` rows, while streaming through the rest of the
+    result to count the rows and compute per-column statistics.
+
+        Returns:
+            The column names, the preview rows and a metadata dict with `row_count` and `column_stats`
+            (a list aligned with the columns).
+    """
+    cursor = engine.execute(query_str)
+    try:
+        column_names = [desc[0] for desc in cursor.description]
+        stats = [_ColumnStats() for _ in column_names]
+        preview, row_count = [], 0
+        while True:
+            batch = cursor.fetchmany(FETCH_BATCH_ROWS)
+            if not batch:
+                break
+            if len(preview) < max_rows:
+                preview.extend(batch[:max_rows - len(preview)])
+            row_count += len(batch)
+            for row in batch:
+                for column_stats, value in zip(stats, row):
+                    column_stats.update(value)
+    finally:
+        cursor.close()
+    return column_names, preview, {"row_count": row_count, "column_stats": [column_stats.to_dict() for column_stats in stats]}
@@ -0,0 +1,425 @@
+import os
+import re
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+import pandas as pd
+from metrics import trace_stage
+
+
+# ---------- Query Store Configs ----------
+STORE_DIR = os.environ.get("ZOOGIST_STORE_DIR", ".zoogist_cache")
+TABLE_NAME = "mammals_df" # Table of the default dataset, see `table_name_for`
+# Streaming ingest: the CSV is read in chunks and appended into the store without keeping the whole frame in memory.
+STREAMING_INGEST = os.environ.get("ZOOGIST_STREAMING_INGEST", "0") == "1"
+STREAM_CHUNKSIZE = int(os.environ.get("ZOOGIST_STREAM_CHUNKSIZE", "100000"))
+
+# Column types of the `mammals_df` table (kept in sync with the schema described in the system prompt).
+COLUMN_TYPES = {
+    "recordedBy": "TEXT",
+    "username": "TEXT",
+    "timestamp": "DATETIME",
+    "date": "DATE",
+    "time": "TIME",
+    "decimalLatitude": "FLOAT",
+    "decimalLongitude": "FLOAT",
+    "place": "TEXT",
+    "habitat": "TEXT",
+    "speciesName": "TEXT",
+    "count": "INTEGER",
+    "countType": "TEXT",
+    "obsType": "TEXT",
+    "scientificName": "TEXT",
+    "instanceID": "TEXT",
+    "conservationStatus": "TEXT",
+}
+INDEXED_COLUMNS = ["speciesName", "habitat", "conservationStatus", "place", "date", "instanceID"]
+# Low-cardinality text columns stored as pandas categoricals after ingest.
+CATEGORICAL_COLUMNS = ["recordedBy", "username", "place", "habitat", "speciesName", "countType", "obsType", "scientificName", "conservationStatus"]
+
+# Raw formats used in the observatory exports.
+DATE_FORMAT = "%d-%m-%Y"
+TIMESTAMP_FORMAT = "%d%b%Y_%H:%M"
+
+# Spatial bins of the map, precomputed in the store: grid cell size (degrees) per map detail level.
+MAP_BINS_TABLE = "map_bins"
+MAP_BIN_LEVELS = {"overview": 0.05, "region": 0.01, "local": 0.0025}
+MAP_MAX_DETAIL_POINTS = 20000
+
+# Summary cubes: aggregate tables precomputed after ingest for the usual count/sum questions (key columns per cube).
+SUMMARY_CUBES = {
+    "cube_species_habitat_year": ["speciesName", "scientificName", "habitat", "year", "conservationStatus"],
+    "cube_species_place": ["speciesName", "scientificName", "place", "conservationStatus"],
+    "cube_user_species": ["username", "recordedBy", "speciesName", "conservationStatus"],
+}
+CUBE_DIMENSION_SQL = {"year": "CAST(strftime('%Y', \"date\") AS INTEGER)"}
+CUBE_MEASURES = [
+    ("observations", "COUNT(*)", "number of observation records"),
+    ("total_count", 'SUM("count")', "sum of `count`, i.e. number of individuals"),
+]
+
+_hash_memo: dict[tuple, str] = {}
+_build_lock = threading.Lock()
+_checked_stores: set[str] = set()
+_local = threading.local()
+
+
+# ---------- Dataset versioning ----------
+def file_content_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 of a file's contents, memoized on (path, size, mtime) so reruns don't re-read the file."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _hash_memo:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+        _hash_memo[memo_key] = digest.hexdigest()
+    return _hash_memo[memo_key]
+
+
+def table_name_for(data_path: str) -> str:
+    """Returns the SQL table of a dataset's records, named after its taxon (`01-mammals-data-final.csv` -> `mammals_df`)."""
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    taxon = re.sub(r"\W+", "_", re.sub(r"^\d+-|-data-final$", "", stem)).strip("_").lower()
+    return f"{taxon or 'records'}_df"
+
+
+def _artifact_prefix(data_path: str) -> str:
+    """`<stem>-<hash of the dataset path>`, so datasets with the same file name in different folders don't collide."""
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    return f"{stem}-{hashlib.sha1(os.path.abspath(data_path).encode()).hexdigest()[:8]}"
+
+
+def store_path_for(data_path: str, content_hash: str, suffix: str = "sqlite") -> str:
+    """Returns the on-disk location of a cached artifact (query store, Parquet sidecar) for a given dataset version."""
+    return os.path.join(STORE_DIR, f"{_artifact_prefix(data_path)}-{content_hash[:16]}.{suffix}")
+
+
+# ---------- Typed ingest ----------
+def apply_column_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Parses `date`/`timestamp` once, stores repeated text columns as categoricals and downcasts integer columns.
+
+    Coordinates are kept as float64, since float32 would alter the decimal values returned by SQL queries.
+    """
+    if "date" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"], format=DATE_FORMAT, errors="coerce")
+    if "timestamp" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    for col, col_type in COLUMN_TYPES.items():
+        if col_type == "INTEGER" and col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+    return df
+
+
+# ---------- Building the store ----------
+def normalise_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the raw `date`/`timestamp` strings to ISO format so SQLite date functions (e.g. `strftime`) work on them."""
+    df = df.copy()
+    if "date" in df.columns:
+        dates = df["date"] if pd.api.types.is_datetime64_any_dtype(df["date"]) else pd.to_datetime(df["date"], format=DATE_FORMAT, errors="coerce")
+        df["date"] = dates.dt.strftime("%Y-%m-%d")
+    if "timestamp" in df.columns:
+        stamps = df["timestamp"] if pd.api.types.is_datetime64_any_dtype(df["timestamp"]) else pd.to_datetime(df["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+        df["timestamp"] = stamps.dt.strftime("%Y-%m-%d %H:%M:%S")
+    return df
+
+
+def _create_table(conn: sqlite3.Connection, columns: list[str], table_name: str):
+    column_defs = ", ".join(f'"{col}" {COLUMN_TYPES.get(col, "TEXT")}' for col in columns)
+    conn.execute(f'CREATE TABLE "{table_name}" ({column_defs})')
+
+
+def _create_indexes(conn: sqlite3.Connection, columns: list[str], table_name: str):
+    for col in INDEXED_COLUMNS:
+        if col in columns:
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{table_name}_{col}" ON "{table_name}" ("{col}")')
+    conn.execute("ANALYZE")
+
+
+def _floor_sql(expr: str) -> str:
+    # SQLite has no FLOOR (unless built with the math functions), CAST truncates towards zero.
+    return f"(CAST({expr} AS INTEGER) - ({expr} < CAST({expr} AS INTEGER)))"
+
+
+def _aggregate_specs() -> dict[str, list[tuple[list, list]]]:
+    """Returns, per precomputed table, the (key columns, measures) groupings that fill it: lists of (name, SQL expression)."""
+    specs = {}
+    # Map bins keep the sums of the coordinates (not their means) so new records can simply be added.
+    map_measures = [("observations", "COUNT(*)"), ("total_count", 'SUM("count")'),
+                    ("lat_sum", "SUM(decimalLatitude)"), ("lon_sum", "SUM(decimalLongitude)")]
+    specs[MAP_BINS_TABLE] = [
+        ([("level", f"'{level}'"), ("cell_lat", _floor_sql(f"decimalLatitude / {cell_size}")),
+          ("cell_lon", _floor_sql(f"decimalLongitude / {cell_size}")), ("conservationStatus", '"conservationStatus"')], map_measures)
+        for level, cell_size in MAP_BIN_LEVELS.items()
+    ]
+    for cube, dimensions in SUMMARY_CUBES.items():
+        keys = [(col, CUBE_DIMENSION_SQL.get(col, f'"{col}"')) for col in dimensions]
+        specs[cube] = [(keys, [(name, expr) for name, expr, _ in CUBE_MEASURES])]
+    return specs
+
+
+def _aggregate_column_types(table: str) -> dict[str, str]:
+    if table == MAP_BINS_TABLE:
+        return {"level": "TEXT", "cell_lat": "INTEGER", "cell_lon": "INTEGER", "conservationStatus": "TEXT",
+                "observations": "INTEGER", "total_count": "INTEGER", "lat_sum": "FLOAT", "lon_sum": "FLOAT"}
+    types = {col: "INTEGER" if col == "year" else COLUMN_TYPES[col] for col in SUMMARY_CUBES[table]}
+    return {**types, **{name: "INTEGER" for name, _, _ in CUBE_MEASURES}}
+
+
+def _create_aggregate_table(conn: sqlite3.Connection, table: str, table_name: str):
+    """Creates & fills a precomputed table (map bins or summary cube) from all the records of the store."""
+    column_defs = ", ".join(f'"{col}" {col_type}' for col, col_type in _aggregate_column_types(table).items())
+    conn.execute(f'CREATE TABLE "{table}" ({column_defs})')
+    for keys, measures in _aggregate_specs()[table]:
+        columns = ", ".join(f'"{name}"' for name, _ in keys + measures)
+        select = ", ".join(expr for _, expr in keys + measures)
+        group_by = ", ".join(str(i + 1) for i in range(len(keys)))
+        conn.execute(f'INSERT INTO "{table}" ({columns}) SELECT {select} FROM "{table_name}" GROUP BY {group_by}')
+    if table == MAP_BINS_TABLE:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{MAP_BINS_TABLE}_level" ON "{MAP_BINS_TABLE}" (level)')
+
+
+def refresh_aggregates(conn: sqlite3.Connection, since_rowid: int, table_name: str = TABLE_NAME):
+    """Adds the records appended after `since_rowid` to the map bins & summary cubes, without re-scanning the store.
+
+    Only the groups of the new records are touched: their measures are added to the existing rows (all measures are
+    counts or sums), and groups seen for the first time are inserted.
+    """
+    for table, groupings in _aggregate_specs().items():
+        for keys, measures in groupings:
+            select = ", ".join(expr for _, expr in keys + measures)
+            group_by = ", ".join(str(i + 1) for i in range(len(keys)))
+            new_groups = conn.execute(f'SELECT {select} FROM "{table_name}" WHERE rowid > ? GROUP BY {group_by}', (since_rowid,)).fetchall()
+            increments = ", ".join(f'"{name}" = "{name}" + ?' for name, _ in measures)
+            # `IS` also matches NULL keys (e.g. records without conservation status)
+            matches = " AND ".join(f'"{name}" IS ?' for name, _ in keys)
+            columns = ", ".join(f'"{name}"' for name, _ in keys + measures)
+            placeholders = ", ".join("?" for _ in keys + measures)
+            for group in new_groups:
+                key_values, measure_values = group[:len(keys)], group[len(keys):]
+                if conn.execute(f'UPDATE "{table}" SET {increments} WHERE {matches}', (*measure_values, *key_values)).rowcount == 0:
+                    conn.execute(f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders})', group)
+
+
+def _ensure_derived_tables(db_path: str, table_name: str):
+    """Adds the precomputed tables missing from a store built by an older version of the app."""
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing_tables = [table for table in _aggregate_specs() if table not in tables]
+        for table in missing_tables:
+            logging.info(f"Adding the precomputed table {table} to the query store {db_path}")
+            _create_aggregate_table(conn, table, table_name)
+        if missing_tables:
+            conn.commit()
+    finally:
+        conn.close()
+
+
+def remove_stale_artifacts(data_path: str, keep: str):
+    """Deletes the artifacts (files or directories) of older dataset versions that share the suffix of `keep` (e.g. `.sqlite`)."""
+    prefix = _artifact_prefix(data_path)
+    suffix = os.path.basename(keep)[len(prefix) + 17:] # Strips "<prefix>-<16 hex digits of the hash>"
+    # Exact names only, the stem may also prefix another dataset's (`02-birds-data-final-2024-data-final.csv`).
+    # Artifacts named before the path hash was added (`<stem>-<16 hex digits>`) are stale as well.
+    stem = os.path.splitext(os.path.basename(data_path))[0]
+    stale_name = re.compile(rf"(?:{re.escape(prefix)}|{re.escape(stem)})-[0-9a-f]{{16}}{re.escape(suffix)}")
+    for name in os.listdir(STORE_DIR) if os.path.isdir(STORE_DIR) else []:
+        old_path = os.path.join(STORE_DIR, name)
+        if stale_name.fullmatch(name) and os.path.abspath(old_path) != os.path.abspath(keep):
+            try:
+                shutil.rmtree(old_path) if os.path.isdir(old_path) else os.remove(old_path)
+                logging.info(f"Removed stale artifact: {old_path}")
+            except OSError as e:
+                logging.warning(f"Could not remove stale artifact {old_path}: {e}")
+
+
+def prepare_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Validates a chunk of occurrence records against the schema and normalises it for the store."""
+    missing_columns = [col for col in COLUMN_TYPES if col not in chunk.columns]
+    if missing_columns:
+        raise ValueError(f"Missing columns in the occurrence records: {missing_columns}")
+
+    chunk = apply_column_types(chunk[list(COLUMN_TYPES)].copy())
+    for col in ["decimalLatitude", "decimalLongitude"]:
+        chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+    valid_rows = chunk["decimalLatitude"].notna() & chunk["decimalLongitude"].notna() & chunk["instanceID"].notna()
+    if not valid_rows.all():
+        logging.warning(f"Dropping {(~valid_rows).sum()} records without coordinates or instanceID.")
+        chunk = chunk[valid_rows]
+    return normalise_frame(chunk)
+
+
+def get_query_store(data_path: str, df: pd.DataFrame | None = None, chunksize: int | None = None) -> str:
+    """Returns the path of the SQLite store for the current version of `data_path`, building it only when the CSV contents change.
+
+        Args:
+            data_path: Path to the source CSV file.
+            df: The already loaded dataframe (optional). When omitted, the CSV is read from disk if a build is needed.
+            chunksize: When set (and `df` is omitted), the CSV is streamed into the store in chunks of this many rows.
+    """
+    db_path = store_path_for(data_path, file_content_hash(data_path))
+    table_name = table_name_for(data_path)
+    if db_path in _checked_stores:
+        return db_path
+
+    with _build_lock:
+        if os.path.exists(db_path):
+            _ensure_derived_tables(db_path, table_name)
+            _checked_stores.add(db_path)
+            return db_path
+        os.makedirs(STORE_DIR, exist_ok=True)
+        logging.info(f"Building query store for {data_path} at {db_path}")
+
+        if df is not None:
+            chunks = [df]
+        elif chunksize:
+            chunks = pd.read_csv(data_path, chunksize=chunksize)
+        else:
+            chunks = [pd.read_csv(data_path)]
+
+        with trace_stage("store_build"):
+            tmp_path = f"{db_path}.tmp-{os.getpid()}"
+            conn = sqlite3.connect(tmp_path)
+            try:
+                _create_table(conn, list(COLUMN_TYPES), table_name)
+                row_count = 0
+                for chunk in chunks:
+                    chunk = prepare_chunk(chunk)
+                    chunk.to_sql(table_name, conn, if_exists="append", index=False, chunksize=10_000)
+                    row_count += len(chunk)
+                # Indexes are created once after the bulk load, which is faster than maintaining them per chunk.
+                _create_indexes(conn, list(COLUMN_TYPES), table_name)
+                for table in _aggregate_specs():
+                    _create_aggregate_table(conn, table, table_name)
+                conn.commit()
+            except Exception:
+                conn.close()
+                os.remove(tmp_path)
+                raise
+            conn.close()
+            os.replace(tmp_path, db_path)
+        logging.info(f"Query store built with {row_count} records.")
+        remove_stale_artifacts(data_path, keep=db_path)
+        _checked_stores.add(db_path)
+    return db_path
+
+
+# ---------- Appending records ----------
+def append_to_store(db_path: str, records: pd.DataFrame, target_path: str, table_name: str = TABLE_NAME) -> int:
+    """Copies the store to `target_path` and appends the (prepared, deduplicated) records to the copy.
+
+    The map bins & summary cubes are refreshed with the new records only, and the indexes are updated in place.
+    Returns the number of appended records.
+    """
+    shutil.copyfile(db_path, target_path)
+    conn = sqlite3.connect(target_path)
+    try:
+        since_rowid = conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table_name}"').fetchone()[0]
+        records[list(COLUMN_TYPES)].to_sql(table_name, conn, if_exists="append", index=False, chunksize=10_000)
+        refresh_aggregates(conn, since_rowid, table_name)
+        _create_indexes(conn, list(COLUMN_TYPES), table_name) # Adds the indexes missing from older stores & refreshes the statistics
+        conn.commit()
+    except Exception:
+        conn.close()
+        os.remove(target_path)
+        raise
+    conn.close()
+    return len(records)
+
+
+# ---------- Reading from the store ----------
+def summarise_store(db_path: str, table_name: str = TABLE_NAME) -> dict:
+    """Returns the small aggregates the app needs without loading the records: column names, row count and filter options."""
+    conn = get_connection(db_path)
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+    row_count = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+    habitats = [row[0] for row in conn.execute(f'SELECT DISTINCT habitat FROM "{table_name}" WHERE habitat IS NOT NULL ORDER BY habitat')]
+    return {
+        "db_path": db_path,
+        "columns": columns,
+        "row_count": row_count,
+        "filter_options": {"habitat": habitats},
+    }
+
+
+def read_map_layer(db_path: str, level: str, table_name: str = TABLE_NAME) -> pd.DataFrame:
+    """Returns the markers of a map detail level: one row per grid cell of `MAP_BIN_LEVELS` (read from the
+    precomputed bins), or per observed location for the "points" level (capped to `MAP_MAX_DETAIL_POINTS`).
+
+    Each row has the marker coordinates, `observations`, `total_count`, a `label` and one column of
+    observation counts per conservation status.
+    """
+    conn = get_connection(db_path)
+    if level in MAP_BIN_LEVELS:
+        counts = pd.read_sql(
+            f"""SELECT cell_lat || ':' || cell_lon AS marker, conservationStatus, observations, total_count, lat_sum, lon_sum
+                FROM "{MAP_BINS_TABLE}" WHERE level = ?""",
+            conn, params=(level,),
+        )
+        labels = None
+    elif level == "points":
+        counts = pd.read_sql(
+            f"""SELECT decimalLatitude || ':' || decimalLongitude AS marker, conservationStatus, COUNT(*) AS observations,
+                       SUM("count") AS total_count, SUM(decimalLatitude) AS lat_sum, SUM(decimalLongitude) AS lon_sum
+                FROM "{table_name}"
+                WHERE (decimalLatitude, decimalLongitude) IN (
+                    SELECT decimalLatitude, decimalLongitude FROM "{table_name}"
+                    GROUP BY decimalLatitude, decimalLongitude ORDER BY COUNT(*) DESC LIMIT {MAP_MAX_DETAIL_POINTS})
+                GROUP BY decimalLatitude, decimalLongitude, conservationStatus""",
+            conn,
+        )
+        labels = pd.read_sql(
+            f"""SELECT decimalLatitude || ':' || decimalLongitude AS marker,
+                       MIN(place) || '<br>' || GROUP_CONCAT(DISTINCT speciesName) AS label
+                FROM "{table_name}" GROUP BY decimalLatitude, decimalLongitude""",
+            conn,
+        ).set_index("marker")["label"]
+    else:
+        raise ValueError(f"Unknown map detail level '{level}'.")
+
+    status_counts = counts.pivot_table(index="marker", columns="conservationStatus", values="observations", aggfunc="sum", fill_value=0)
+    layer = counts.groupby("marker")[["observations", "total_count", "lat_sum", "lon_sum"]].sum()
+    layer["decimalLatitude"] = layer.pop("lat_sum") / layer["observations"]
+    layer["decimalLongitude"] = layer.pop("lon_sum") / layer["observations"]
+    layer["label"] = labels.reindex(layer.index) if labels is not None else layer["observations"].astype(str) + " observations"
+    return layer.join(status_counts).reset_index(drop=True)
+
+
+def existing_instance_ids(db_path: str, instance_ids: list[str], table_name: str = TABLE_NAME, batch_size: int = 500) -> set[str]:
+    """Returns the instanceIDs (among `instance_ids`) already in the store."""
+    conn = get_connection(db_path)
+    existing = set()
+    for start in range(0, len(instance_ids), batch_size):
+        batch = instance_ids[start:start + batch_size]
+        placeholders = ", ".join("?" for _ in batch)
+        existing.update(row[0] for row in conn.execute(f'SELECT instanceID FROM "{table_name}" WHERE instanceID IN ({placeholders})', batch))
+    return existing
+
+
+def read_summary_cubes(db_path: str) -> dict[str, pd.DataFrame]:
+    """Returns the summary cubes of the store as dataframes (they are small, e.g. to register them in DuckDB)."""
+    conn = get_connection(db_path)
+    return {cube: pd.read_sql(f'SELECT * FROM "{cube}"', conn) for cube in SUMMARY_CUBES}
+
+
+# ---------- Pooled read-only connections ----------
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """Returns a read-only connection to the store, reused for the lifetime of the calling thread."""
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        # Drop connections to stores that were replaced by a newer dataset version.
+        for stale_path in [path for path in connections if not os.path.exists(path)]:
+            connections.pop(stale_path).close()
+        conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True)
+        connections[db_path] = conn
+    return conn
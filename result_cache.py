@@ -0,0 +1,193 @@
+import os
+import re
+import sys
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+
+try:
+    import pyarrow as pa
+except ImportError: # Results are then kept as plain column lists
+    pa = None
+
+
+# ---------- Result Cache Configs ----------
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("ZOOGIST_RESULT_CACHE_MB", "64")) * 1024 ** 2
+
+_SQL_TOKEN = re.compile(
+    r"""(?P<comment>--[^\n]*|/\*.*?\*/)
+       |(?P<string>'(?:[^']|'')*')
+       |(?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+       |(?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+       |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+       |(?P<symbol><=|>=|<>|!=|==|\|\||\S)""",
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def _unquote(token: str) -> str:
+    if token[0] == '"':
+        return token[1:-1].replace('""', '"')
+    return token[1:-1] if token[0] in "`[" else token
+
+
+def canonicalise_sql(query_str: str, identifiers: frozenset[str] = frozenset()) -> tuple[str, dict[str, str]]:
+    """Returns a canonical form of the query (comments stripped, whitespace collapsed, keywords & identifiers
+    lower-cased, aliases renamed) and the mapping of alias placeholders to the aliases used in this query.
+
+    Identifiers are case-insensitive in SQLite, so lower-casing them is safe; string literals are left untouched.
+    A double-quoted token is a string literal in SQLite when no column has that name, so it is only treated as
+    an identifier when it names one of the (lower-cased) table & column `identifiers` or an alias of the query.
+    Aliases named like one of the `identifiers`, or like a function called in the query, are kept: their other
+    occurrences may refer to the column, table or function instead.
+    """
+    matches = [(match.lastgroup, match.group()) for match in _SQL_TOKEN.finditer(query_str) if match.lastgroup != "comment"]
+    alias_names = {_unquote(token).lower() for (_, previous), (kind, token) in zip(matches, matches[1:])
+                   if previous.lower() == "as" and kind in ("word", "quoted")}
+    tokens = []
+    for kind, token in matches:
+        original = token
+        if kind == "quoted":
+            name = _unquote(token)
+            if token.startswith('"') and name.lower() not in identifiers and name.lower() not in alias_names:
+                tokens.append(("string", token, original))
+                continue
+            token, kind = name, "word"
+        if kind == "word":
+            token = token.lower()
+        tokens.append((kind, token, original))
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+
+    # Aliases (`<expr> AS <alias>`) only name result columns, so they are replaced by positional placeholders.
+    called = {tokens[i - 1][1] for i in range(1, len(tokens)) if tokens[i][1] == "(" and tokens[i - 1][0] == "word"}
+    aliases: dict[str, tuple[str, str]] = {}
+    for i in range(1, len(tokens)):
+        name = tokens[i][1]
+        if tokens[i - 1][1] == "as" and tokens[i][0] == "word" and name not in aliases and name not in identifiers and name not in called:
+            original = tokens[i][2].strip('"`[]')
+            aliases[name] = (f"_alias{len(aliases)}", original)
+    canonical = " ".join(aliases[token][0] if kind == "word" and token in aliases else token for kind, token, _ in tokens)
+    return canonical, {placeholder: original for placeholder, original in aliases.values()}
+
+
+class ResultCache:
+    """Bounded, size-aware LRU cache of query results shared by all sessions of the app.
+
+    Results are stored column-wise (as Arrow arrays when `pyarrow` is installed) under the canonical SQL and
+    the store of the dataset version they were computed on. Entries of dataset versions whose store was
+    replaced are dropped.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _to_columns(column_names: list[str], rows: list[tuple]) -> tuple[list, int]:
+        columns = [list(values) for values in zip(*rows)] if rows else [[] for _ in column_names]
+        if pa is not None:
+            try:
+                arrays = [pa.array(values) for values in columns]
+                return arrays, sum(array.nbytes for array in arrays)
+            except (pa.ArrowInvalid, pa.ArrowTypeError): # Mixed types within a column (SQLite is dynamically typed)
+                pass
+        return columns, sum(sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values) for values in columns)
+
+    @staticmethod
+    def _to_rows(columns: list) -> list[tuple]:
+        columns = [values.to_pylist() if pa is not None and isinstance(values, pa.Array) else values for values in columns]
+        return list(zip(*columns))
+
+    def get(self, engine, query_str: str) -> tuple[list[str], list[tuple], dict] | None:
+        """Returns the cached (column names, rows, metadata) of the query, with the aliases of this query, or `None`."""
+        canonical, aliases = canonicalise_sql(query_str, engine.identifiers)
+        key = (engine.cache_key, canonical)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        column_names = [aliases.get(name, name) for name in entry["column_names"]]
+        return column_names, self._to_rows(entry["columns"]), entry["meta"]
+
+    def put(self, engine, query_str: str, column_names: list[str], rows: list[tuple], meta: dict | None = None):
+        canonical, aliases = canonicalise_sql(query_str, engine.identifiers)
+        placeholders = {original.lower(): placeholder for placeholder, original in aliases.items()}
+        columns, size = self._to_columns(column_names, rows)
+        if size > self.max_bytes:
+            return
+        key = (engine.cache_key, canonical)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)["size"]
+            self._entries[key] = {
+                "db_path": engine.db_path,
+                "column_names": [placeholders.get(name.lower(), name) for name in column_names],
+                "columns": columns,
+                "meta": meta or {},
+                "size": size,
+            }
+            self.current_bytes += size
+            self._evict()
+
+    def _evict(self):
+        # Stores of older dataset versions are deleted once a new version is built.
+        stale_paths = {path for path in {entry["db_path"] for entry in self._entries.values()} if not os.path.exists(path)}
+        for key in [key for key, entry in self._entries.items() if entry["db_path"] in stale_paths]:
+            self.current_bytes -= self._entries.pop(key)["size"]
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self.current_bytes -= entry["size"]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self.current_bytes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+class ResultHandles:
+    """Bounded registry mapping result handles (returned to the LLM) to the engine & query they were produced by.
+
+    Engines are weakly referenced, so the datasets evicted by `load_query_engine` are not kept in memory by their
+    handles (which then expire).
+    """
+
+    def __init__(self, max_handles: int = 512):
+        self.max_handles = max_handles
+        self._handles: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, engine, query_str: str) -> str:
+        canonical, _ = canonicalise_sql(query_str, engine.identifiers)
+        handle = "res_" + hashlib.sha1(f"{engine.cache_key}|{canonical}".encode()).hexdigest()[:10]
+        with self._lock:
+            self._handles[handle] = (weakref.ref(engine), query_str)
+            self._handles.move_to_end(handle)
+            while len(self._handles) > self.max_handles:
+                self._handles.popitem(last=False)
+        return handle
+
+    def resolve(self, handle: str) -> tuple | None:
+        with self._lock:
+            entry = self._handles.get(handle)
+        if entry is None:
+            return None
+        engine_ref, query_str = entry
+        engine = engine_ref()
+        return None if engine is None else (engine, query_str)
+
+
+# Process-wide instances, shared by the Streamlit sessions.
+result_cache = ResultCache()
+result_handles = ResultHandles()
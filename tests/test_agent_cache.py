@@ -0,0 +1,53 @@
+import pytest
+
+import agent_cache
+import query_store
+from agent_cache import QueryCache
+
+
+@pytest.fixture
+def query_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_store, "STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(agent_cache, "STORE_DIR", str(tmp_path))
+    cache = QueryCache(str(tmp_path / "01-mammals-data-final.csv"))
+    cache.ensure_version("v1")
+    cache.put("Which habitats have Tiger observations but no Leopard observations?",
+              {"output": "tiger-not-leopard", "sql_queries": ["SELECT 1"]})
+    return cache
+
+
+def test_exact_match(query_cache):
+    response = query_cache.get("which habitats have tiger observations, but no leopard observations")
+    assert response["output"] == "tiger-not-leopard"
+    assert response["cache_match"] == "exact"
+
+
+def test_near_duplicate_match(query_cache):
+    response = query_cache.get("Which of the habitats have the Tiger observations but no Leopard observations?")
+    assert response["output"] == "tiger-not-leopard"
+    assert response["cache_match"].startswith("similar")
+
+
+def test_word_order_is_not_ignored(query_cache):
+    assert query_cache.get("Which habitats have Leopard observations but no Tiger observations?") is None
+
+
+LONG_QUESTION = "How many Vulnerable species were observed per habitat in 2021 by the users of the observatory?"
+
+
+@pytest.fixture
+def long_query_cache(query_cache):
+    query_cache.put(LONG_QUESTION, {"output": "vulnerable-2021-habitat", "sql_queries": ["SELECT 1"]})
+    return query_cache
+
+
+def test_filler_words_may_differ(long_query_cache):
+    response = long_query_cache.get("Can you tell me how many Vulnerable species were observed per habitat in 2021 by users of the observatory")
+    assert response["output"] == "vulnerable-2021-habitat"
+    assert response["cache_match"].startswith("similar")
+
+
+@pytest.mark.parametrize("original, substitute", [("Vulnerable", "Endangered"), ("2021", "2022"), ("habitat", "month")])
+def test_dataset_values_and_numbers_may_not_differ(long_query_cache, original, substitute):
+    # The TF-IDF similarity of these one-word substitutions is above the threshold
+    assert long_query_cache.get(LONG_QUESTION.replace(original, substitute)) is None
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import agent_cache
+import ingest
+import query_store
+from ingest import append_records
+
+SOURCE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "01-mammals-data-final.csv")
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    for module in (query_store, ingest, agent_cache):
+        monkeypatch.setattr(module, "STORE_DIR", str(tmp_path / "store"))
+    return tmp_path
+
+
+def test_rows_follow_the_header_of_the_dataset(store_dir):
+    source = pd.read_csv(SOURCE_CSV, dtype=str)
+    # A dataset with the same schema, but its columns in another order and an extra column
+    columns = list(reversed(source.columns)) + ["notes"]
+    data_path = str(store_dir / "02-birds-data-final.csv")
+    source.iloc[:20].assign(notes="seen").reindex(columns=columns).to_csv(data_path, index=False)
+
+    batch = source.iloc[20:25] # In the column order of the mammals CSV, without the extra column
+    summary = append_records(data_path, batch.reset_index(drop=True))
+    assert summary["appended"] == 5
+
+    appended = pd.read_csv(data_path, dtype=str).iloc[20:]
+    assert list(appended.columns) == columns
+    assert appended["notes"].isna().all()
+    pd.testing.assert_frame_equal(appended[list(source.columns)].reset_index(drop=True), batch.reset_index(drop=True))
+
+
+def test_same_results_compares_the_rows(tmp_path):
+    paths = []
+    for name, rows in [("old", range(3000)), ("new", range(3001))]:
+        paths.append(str(tmp_path / f"{name}.sqlite"))
+        conn = sqlite3.connect(paths[-1])
+        conn.execute("CREATE TABLE mammals_df (instanceID TEXT, count INTEGER)")
+        conn.executemany("INSERT INTO mammals_df VALUES (?, ?)", [(f"uuid:{i}", i % 7) for i in rows])
+        conn.commit()
+        conn.close()
+
+    assert ingest._same_results(*paths, ["SELECT COUNT(*) FROM mammals_df WHERE count > 100"])
+    assert not ingest._same_results(*paths, ["SELECT instanceID FROM mammals_df ORDER BY rowid"])
+    assert not ingest._same_results(*paths, ["SELECT missing_column FROM mammals_df"])
+
+
+def test_typed_dates_are_written_in_the_formats_of_the_dataset(store_dir):
+    source = pd.read_csv(SOURCE_CSV, dtype=str)
+    data_path = str(store_dir / "01-mammals-data-final.csv")
+    source.iloc[:20].to_csv(data_path, index=False)
+
+    batch = query_store.apply_column_types(source.iloc[20:25].reset_index(drop=True))
+    assert pd.api.types.is_datetime64_any_dtype(batch["date"])
+    assert append_records(data_path, batch)["appended"] == 5
+
+    appended = pd.read_csv(data_path, dtype=str).iloc[20:].reset_index(drop=True)
+    pd.testing.assert_series_equal(appended["date"], source["date"].iloc[20:25].reset_index(drop=True))
+    pd.testing.assert_series_equal(appended["timestamp"], source["timestamp"].iloc[20:25].reset_index(drop=True))
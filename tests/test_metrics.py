@@ -0,0 +1,26 @@
+import logging
+import threading
+
+from metrics import MetricsRegistry
+
+
+def test_concurrent_flushes_write_a_complete_file(tmp_path, caplog):
+    registry = MetricsRegistry(path=str(tmp_path / "metrics.prom"), flush_seconds=0)
+    start = threading.Barrier(8)
+
+    def observe():
+        start.wait()
+        for _ in range(50):
+            registry.observe("sql", 0.01, tool="execute_sql_query")
+            registry.flush()
+
+    threads = [threading.Thread(target=observe) for _ in range(8)]
+    with caplog.at_level(logging.WARNING):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert not caplog.records
+    registry.flush()
+    assert (tmp_path / "metrics.prom").read_text() == registry.render()
+    assert list(tmp_path.iterdir()) == [tmp_path / "metrics.prom"]
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import query_store
+from query_store import remove_stale_artifacts, store_path_for
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(query_store, "STORE_DIR", str(tmp_path / "store"))
+    os.makedirs(query_store.STORE_DIR)
+    return tmp_path
+
+
+def _touch(path: str) -> str:
+    open(path, "w").close()
+    return path
+
+
+def test_same_file_names_in_different_folders_do_not_collide(store_dir):
+    assert store_path_for(str(store_dir / "a" / "02-birds-data-final.csv"), "0" * 64) != \
+        store_path_for(str(store_dir / "b" / "02-birds-data-final.csv"), "0" * 64)
+
+
+def test_only_older_versions_of_the_dataset_are_removed(store_dir):
+    data_path = str(store_dir / "02-birds-data-final.csv")
+    other_path = str(store_dir / "02-birds-data-final-2024-data-final.csv")
+    old_store = _touch(store_path_for(data_path, "1" * 64))
+    old_parquet = _touch(store_path_for(data_path, "1" * 64, suffix="parquet"))
+    other_store = _touch(store_path_for(other_path, "1" * 64))
+    other_folder_store = _touch(store_path_for(str(store_dir / "b" / "02-birds-data-final.csv"), "1" * 64))
+    legacy_store = _touch(os.path.join(query_store.STORE_DIR, f"02-birds-data-final-{'3' * 16}.sqlite"))
+    new_store = _touch(store_path_for(data_path, "2" * 64))
+
+    remove_stale_artifacts(data_path, keep=new_store)
+    assert not os.path.exists(old_store) and not os.path.exists(legacy_store)
+    assert all(os.path.exists(path) for path in [old_parquet, other_store, other_folder_store, new_store])
@@ -0,0 +1,123 @@
+import gc
+import sqlite3
+import weakref
+
+import pytest
+
+from query_engines import SQLiteEngine, run_bounded_query
+from result_cache import ResultCache, ResultHandles, canonicalise_sql
+
+IDENTIFIERS = frozenset({"mammals_df", "speciesname", "habitat", "count", "place"})
+
+
+def canonical(query_str: str) -> str:
+    return canonicalise_sql(query_str, IDENTIFIERS)[0]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    db_path = str(tmp_path / "store.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE mammals_df ("speciesName" TEXT, "habitat" TEXT, "count" INTEGER)')
+    conn.executemany("INSERT INTO mammals_df VALUES (?, ?, ?)",
+                     [("Tiger", "Coffee_Plantation", 1), ("Gaur", "Coffee_Plantation", 5), ("Gaur", "Forest", 2)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+@pytest.fixture
+def engine(db_path):
+    return SQLiteEngine(db_path)
+
+
+def test_formatting_and_case_are_ignored():
+    assert canonical("SELECT speciesName FROM mammals_df -- species\nWHERE habitat = 'Forest';") == \
+        canonical("select  SPECIESNAME\nfrom \"mammals_df\" where HABITAT='Forest'")
+
+
+def test_string_literals_keep_their_case():
+    assert canonical("SELECT * FROM mammals_df WHERE habitat = 'Forest'") != \
+        canonical("SELECT * FROM mammals_df WHERE habitat = 'forest'")
+
+
+def test_double_quoted_literals_keep_their_case():
+    # Double-quoted tokens naming no column are string literals in SQLite
+    assert canonical('SELECT * FROM mammals_df WHERE habitat = "Forest"') != \
+        canonical('SELECT * FROM mammals_df WHERE habitat = "forest"')
+    assert canonical('SELECT "speciesName" FROM "Mammals_DF"') == canonical("SELECT speciesname FROM mammals_df")
+
+
+def test_double_quoted_literals_are_cached_apart(engine):
+    cache = ResultCache()
+    first = 'SELECT speciesName FROM mammals_df WHERE habitat = "Forest"'
+    column_names, rows, meta = run_bounded_query(engine, first, 20)
+    assert meta["row_count"] == 1
+    cache.put(engine, first, column_names, rows, meta)
+
+    second = 'SELECT speciesName FROM mammals_df WHERE habitat = "forest"'
+    assert cache.get(engine, second) is None
+    assert run_bounded_query(engine, second, 20)[2]["row_count"] == 0
+
+
+def test_aliases_are_renamed():
+    canonical_sql, aliases = canonicalise_sql("SELECT speciesName AS Sp, SUM(count) AS total FROM mammals_df GROUP BY Sp", IDENTIFIERS)
+    assert canonical_sql == canonical("SELECT speciesName AS name, SUM(count) AS n FROM mammals_df GROUP BY name")
+    assert aliases == {"_alias0": "Sp", "_alias1": "total"}
+
+
+def test_aliases_named_like_a_column_are_kept():
+    assert canonical("SELECT speciesName AS habitat, COUNT(*) AS n FROM mammals_df WHERE habitat = 'Coffee_Plantation' GROUP BY speciesName") != \
+        canonical("SELECT speciesName AS sp, COUNT(*) AS n FROM mammals_df WHERE sp = 'Coffee_Plantation' GROUP BY speciesName")
+
+
+def test_aliases_named_like_a_called_function_are_kept():
+    assert canonical("SELECT speciesName AS total, total(count) AS n FROM mammals_df GROUP BY speciesName") != \
+        canonical("SELECT speciesName AS sp, sp(count) AS n FROM mammals_df GROUP BY speciesName")
+
+
+def test_engine_identifiers(engine):
+    assert {"mammals_df", "speciesname", "habitat", "count"} <= engine.identifiers
+
+
+def test_cache_returns_the_aliases_of_the_query(engine):
+    cache = ResultCache()
+    query_str = "SELECT habitat, SUM(count) AS total FROM mammals_df GROUP BY habitat ORDER BY habitat"
+    column_names, rows, meta = run_bounded_query(engine, query_str, 20)
+    cache.put(engine, query_str, column_names, rows, meta)
+
+    cached = cache.get(engine, "SELECT habitat, SUM(count) AS n FROM mammals_df GROUP BY habitat ORDER BY habitat")
+    assert cached == (["habitat", "n"], rows, meta)
+
+
+def test_cache_does_not_confuse_an_alias_with_a_column(engine):
+    cache = ResultCache()
+    first = "SELECT speciesName AS habitat, COUNT(*) AS n FROM mammals_df WHERE habitat = 'Coffee_Plantation' GROUP BY speciesName"
+    column_names, rows, meta = run_bounded_query(engine, first, 20)
+    assert meta["row_count"] == 2
+    cache.put(engine, first, column_names, rows, meta)
+
+    second = "SELECT speciesName AS sp, COUNT(*) AS n FROM mammals_df WHERE sp = 'Coffee_Plantation' GROUP BY speciesName"
+    assert cache.get(engine, second) is None
+    assert run_bounded_query(engine, second, 20)[2]["row_count"] == 0
+
+
+def test_handles_of_different_queries_differ(engine):
+    handles = ResultHandles()
+    first = handles.register(engine, "SELECT speciesName AS habitat FROM mammals_df WHERE habitat = 'Forest'")
+    second = handles.register(engine, "SELECT speciesName AS sp FROM mammals_df WHERE sp = 'Forest'")
+    assert first != second
+
+
+def test_handles_do_not_keep_evicted_engines_alive(db_path):
+    engine = SQLiteEngine(db_path)
+    handles = ResultHandles()
+    query_str = "SELECT speciesName FROM mammals_df"
+    handle = handles.register(engine, query_str)
+    assert handles.resolve(handle) == (engine, query_str)
+
+    engine_ref = weakref.ref(engine)
+    del engine
+    gc.collect()
+    assert engine_ref() is None
+    assert handles.resolve(handle) is None
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from utils import extract_partial_answer
+
+ANSWER = json.dumps({"summary": 'Tiger 🐯 "Panthera tigris"\nseen in Coorg', "sql_queries": []})
+
+
+def test_plain_text_is_returned_as_is():
+    assert extract_partial_answer("Tigers are mostly seen in forests") == "Tigers are mostly seen in forests"
+
+
+def test_no_answer_yet():
+    assert extract_partial_answer('{"sql_queries": ["SELECT') is None
+
+
+def test_complete_answer_is_decoded():
+    assert extract_partial_answer(ANSWER) == json.loads(ANSWER)["summary"]
+
+
+@pytest.mark.parametrize("end", range(len(ANSWER)))
+def test_every_prefix_decodes_to_a_prefix_of_the_answer(end):
+    partial = extract_partial_answer(ANSWER[:end])
+    assert partial is None or json.loads(ANSWER)["summary"].startswith(partial)
+    if partial:
+        partial.encode("utf-8") # Raises on lone surrogates, which cannot be sent to the browser either
+
+
+def test_surrogate_pair_waits_for_the_low_surrogate():
+    assert extract_partial_answer('{"summary": "Tiger \\ud83d') == "Tiger "
+    assert extract_partial_answer('{"summary": "Tiger \\ud83d\\udc2') == "Tiger "
+    assert extract_partial_answer('{"summary": "Tiger \\ud83d\\udc2f') == "Tiger \U0001f42f"
+
+
+@pytest.mark.parametrize("escape", ["\\uZZ12", "\\u+123", "\\u1_23", "\\udc2f", "\\ud83d\\u0041"])
+def test_malformed_escapes_end_the_partial_answer(escape):
+    assert extract_partial_answer('{"summary": "Tiger ' + escape + ' seen"}') == "Tiger "
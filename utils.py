@@ -1,138 +1,197 @@
 import os
+import json
+import numpy as np
 import pandas as pd
 import sqlite3
 import logging
+import re
+import time
+import queue
+import concurrent.futures
 import streamlit as st
-import plotly.graph_objects as go
-from langchain_groq import ChatGroq
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages.system import SystemMessage
-from langchain_core.tools import Tool
-from langchain.agents import create_openai_tools_agent, AgentExecutor
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable
+from query_store import COLUMN_TYPES, CUBE_MEASURES, SUMMARY_CUBES, TABLE_NAME, STORE_DIR, STREAM_CHUNKSIZE, apply_column_types, file_content_hash, get_query_store, read_map_layer, remove_stale_artifacts, store_path_for, summarise_store, table_name_for
+from agent_cache import QueryCache, is_cacheable, normalise_question
+from agent_runner import AgentRunner
+from result_cache import result_cache, result_handles
+from figure_cache import figure_cache
+from datasets import MAX_RESIDENT_DATASETS, dataset_label
+from metrics import agent_callbacks, count, trace_stage
+from query_engines import QUERY_ENGINE, QueryEngine, SQLiteEngine, DuckDBEngine, create_query_engine, run_bounded_query
 # from langchain_core.exceptions import OutputParserException
 # from typing import List, Dict, Any
 
+# LangChain & Plotly are slow to import: they are only imported once the agent or a figure is built (faster cold starts).
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
+    from langchain_core.prompts import ChatPromptTemplate
 
-# ---------- Logging & GROQ API Key Configs ----------
+
+# ---------- Logging Configs ----------
+# (The GROQ API key is read from the secrets when the Groq LLM is created, see `llm_providers.create_llm`.)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-os.environ["GROQ_API_KEY"] = st.secrets["GROQ_API_KEY"]
 
 
 # ---------- Data Specific Prompt Template Creation ----------
-prompt = ChatPromptTemplate.from_messages([
-    SystemMessage(
-        content=(
-            "You are an expert SQL generator, data analysis, and visualization assistant.\n"
-            "Your task is to understand user requests, provide helpful, informative responses, and suggest appropriate data visualizations using the `mammals_df` dataset.\n"
-            "This dataframe contains information about mammal occurrences.\n"
-            "The dataframe has the following columns:\n"
-            "   - `recordedBy` (TEXT) - The person who recorded the observation.\n"
-            "   - `username` (TEXT) - The username of person associated with the observation.\n"
-            "   - `timestamp` (DATETIME) - Automatic date and time of the observation.\n"
-            "   - `date` (DATE) - The date of the observation.\n"
-            "   - `time` (TIME) - The time of the observation.\n"
-            "   - `decimalLatitude` (FLOAT) - The latitude of the observation  in decimal degrees N.\n"
-            "   - `decimalLongitude` (FLOAT) - The longitude of the observation in decimal degrees E.\n"
-            "   - `place` (TEXT) - Name of locality.\n"
-            "   - `habitat` (TEXT) - The type of habitat where the mammal was observed.\n"
-            "   - `speciesName` (TEXT) - The common name of the mammal species.\n"
-            "   - `count` (INTEGER) - The number of individual mammals observed.\n"
-            "   - `countType` (TEXT) - Total (fully counted groups) or Partial (incompletely counted groups) types for the count.\n"
-            "   - `obsType` (TEXT) - The type of observation method.\n"
-            "   - `scientificName` (TEXT) - The scientific name of the species.\n"
-            "   - `instanceID` (TEXT) - A unique identifier for the observation.\n"
-            "   - `conservationStatus` (TEXT) - The conservation status of the species.\n"
-            "When a user asks a question:\n"
-                  "   1. Analyze the user's question carefully. If the question requires fetching data from `mammals_df` (e.g., filtering, selecting columns, doing calculations, aggregations like counting or average), generate an appropriate SQL query and call the `execute_sql_query` function to retrieve the data.\n"
-                  "   2. The SQL query must start with `SELECT` and `FROM` keywords followed by the required column names. Use `WHERE` to filter the data based on specific conditions if needed. Use `GROUP BY` for aggregation if needed. If aggregations like sum, average or counting is required on any of the columns, make sure to create an alias for that in your SQL query. You must include the alias of aggregated columns in the x and y axes names.\n"
-                  "   3. To extract the year from the 'date' column, use the SQL function `strftime('%Y', date)` in your query, when the user specifically asks for anything related to observation year. Use date column only if specifically asked for.\n"
-                  "   4. The SQL queries are case-insensitive and must only use column names mentioned above. The SQL queries must be valid and return appropriate column results based on the user questions.\n"
-                  "   5. The `execute_sql_query` function will return a dictionary with the `sql_query_result` (list of dictionaries) and a `message`.\n"
-                  "   6. If `sql_query_result` is `None`, return a message as the final answer and do not generate any kind of summarized insights or suggest any chart types if `sql_query_result` is `None`.\n"
-                  "   7. If `sql_query_result` is not `None`, then based on the user's query, the SQL data retrieved, generate a short summary of findings and include a suitable chart type from the following allowed chart types: `bar_chart`, `pie_chart`, `line_chart`, and `scatter_plot`, based on the nature of the data retrieved.\n"
-                  "   8.  In the summary, you must mention the x and y-axis columns needed for plotting the charts, make sure that the y axis column must be an alias from your SQL query if aggregation is needed. Include group by column name if the chart type needs grouping. All these columns must be taken from the dataframe `mammals_df`.\n"
-                  "   9.  For example, if you generate a 'bar_chart', include appropriate x and y-axis columns with optional group by column. If you generate a 'pie_chart', only include x-axis column and no y-axis column or group by column. If you generate a 'scatter_plot', then include both x and y-axis columns. Similarly, if you are generating a `line_chart`, then add both x and y-axis columns.\n"
-                  "   10. You must choose chart types carefully to show accurate information based on the user question. For example:\n"
-                  "       - Use 'bar_chart' when you need to compare discrete values or counts for different categories or for showing distributions of values or frequencies.\n"
-                  "       - Use 'line_chart' when you need to show the trends or changes over a continuous variable (e.g., over time) or to see the relationships between two continuous numerical variables.\n"
-                  "       - Use 'pie_chart' when you want to show proportional data or percentage contribution for different categories.\n"
-                  "       - Use 'scatter_plot' when you want to show the relation between two continuous numerical columns and want to see patterns in the data.\n"
-                  "   11. The summary should be concise, informative and should also include the chart type, x-axis, y-axis, and group by column(if any) to display the visualization parameters.\n"
-                  "   12. If the user question can be answered without querying the `mammals_df`, return the answer directly as a string.\n"
-                  "   13. If there is an error during executing SQL query, then make sure to display the error message as the final output. Do not show anything else."
-
-        )
-    ),
-    MessagesPlaceholder(variable_name="agent_scratchpad"),
-    ("user", "{input}")
-])
+def _summary_cubes_description(table_name: str = TABLE_NAME) -> str:
+    """Describes the summary cubes of the query store for the system prompt."""
+    measures = ", ".join(f"`{name}` ({description})" for name, _, description in CUBE_MEASURES)
+    lines = [
+        "Pre-aggregated summary tables are also available, with one row per combination of their key columns and the measures " + measures + ":\n",
+        *(f"   - `{cube}` with the key columns {', '.join(f'`{col}`' for col in dimensions)}.\n" for cube, dimensions in SUMMARY_CUBES.items()),
+        "   The `year` column is the (INTEGER) year of the observation `date`. These tables are much smaller than `" + table_name + "`: prefer them whenever "
+        "the question only needs their columns, using `SUM(total_count)` instead of `SUM(count)` and `SUM(observations)` instead of `COUNT(*)` "
+        "(`COUNT(DISTINCT ...)` of key columns works as usual).\n",
+    ]
+    return "".join(lines)
+
+
+# Descriptions of the observatory schema columns (shared by all the taxa datasets).
+COLUMN_DESCRIPTIONS = {
+    "recordedBy": "The person who recorded the observation.",
+    "username": "The username of person associated with the observation.",
+    "timestamp": "Automatic date and time of the observation.",
+    "date": "The date of the observation.",
+    "time": "The time of the observation.",
+    "decimalLatitude": "The latitude of the observation  in decimal degrees N.",
+    "decimalLongitude": "The longitude of the observation in decimal degrees E.",
+    "place": "Name of locality.",
+    "habitat": "The type of habitat where the {taxon} was observed.",
+    "speciesName": "The common name of the {taxon} species.",
+    "count": "The number of individual {taxa} observed.",
+    "countType": "Total (fully counted groups) or Partial (incompletely counted groups) types for the count.",
+    "obsType": "The type of observation method.",
+    "scientificName": "The scientific name of the species.",
+    "instanceID": "A unique identifier for the observation.",
+    "conservationStatus": "The conservation status of the species.",
+}
+
+
+def build_prompt(table_name: str = TABLE_NAME, taxa: str = "mammals", columns: list[str] | None = None) -> "ChatPromptTemplate":
+    """Generates the system prompt of the agent for a dataset: its table, taxon and column schema (all the observatory columns by default)."""
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.messages.system import SystemMessage
+
+    taxon = taxa[:-1] if taxa.endswith("s") else taxa
+    schema = "".join(
+        f"   - `{col}` ({COLUMN_TYPES.get(col, 'TEXT')})" + (f" - {COLUMN_DESCRIPTIONS[col].format(taxon=taxon, taxa=taxa)}" if col in COLUMN_DESCRIPTIONS else "") + "\n"
+        for col in (columns or list(COLUMN_TYPES))
+    )
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(
+            content=(
+                "You are an expert SQL generator, data analysis, and visualization assistant.\n"
+                f"Your task is to understand user requests, provide helpful, informative responses, and suggest appropriate data visualizations using the `{table_name}` dataset.\n"
+                f"This dataframe contains information about {taxon} occurrences.\n"
+                "The dataframe has the following columns:\n"
+                + schema
+                + _summary_cubes_description(table_name) +
+                "When a user asks a question:\n"
+                      f"   1. Analyze the user's question carefully. If the question requires fetching data from `{table_name}` (e.g., filtering, selecting columns, doing calculations, aggregations like counting or average), generate an appropriate SQL query and call the `execute_sql_query` function to retrieve the data.\n"
+                      "   2. The SQL query must start with `SELECT` and `FROM` keywords followed by the required column names. Use `WHERE` to filter the data based on specific conditions if needed. Use `GROUP BY` for aggregation if needed. If aggregations like sum, average or counting is required on any of the columns, make sure to create an alias for that in your SQL query. You must include the alias of aggregated columns in the x and y axes names.\n"
+                      "   3. To extract the year from the 'date' column, use the SQL function `strftime('%Y', date)` in your query, when the user specifically asks for anything related to observation year. Use date column only if specifically asked for.\n"
+                      "   4. The SQL queries are case-insensitive and must only use table and column names mentioned above. The SQL queries must be valid and return appropriate column results based on the user questions.\n"
+                      "   5. The `execute_sql_query` function will return a dictionary with the `sql_query_result` (list of dictionaries with at most the first 20 rows), `row_count` (total number of rows), `column_stats` (nulls, min, max and mean per column), a `result_handle` and a `message`. Only if the answer needs rows beyond the preview, call the `fetch_query_results` function with the `result_handle` and an `offset` and `limit`, or with an `aggregate_sql` query over the table `result`. Prefer aggregating in the SQL query itself over fetching many rows.\n"
+                      "   6. If `sql_query_result` is `None`, return a message as the final answer and do not generate any kind of summarized insights or suggest any chart types if `sql_query_result` is `None`.\n"
+                      "   7. If `sql_query_result` is not `None`, then based on the user's query, the SQL data retrieved, generate a short summary of findings and include a suitable chart type from the following allowed chart types: `bar_chart`, `pie_chart`, `line_chart`, and `scatter_plot`, based on the nature of the data retrieved.\n"
+                      f"   8.  In the summary, you must mention the x and y-axis columns needed for plotting the charts, make sure that the y axis column must be an alias from your SQL query if aggregation is needed. Include group by column name if the chart type needs grouping. All these columns must be taken from the dataframe `{table_name}`.\n"
+                      "   9.  For example, if you generate a 'bar_chart', include appropriate x and y-axis columns with optional group by column. If you generate a 'pie_chart', only include x-axis column and no y-axis column or group by column. If you generate a 'scatter_plot', then include both x and y-axis columns. Similarly, if you are generating a `line_chart`, then add both x and y-axis columns.\n"
+                      "   10. You must choose chart types carefully to show accurate information based on the user question. For example:\n"
+                      "       - Use 'bar_chart' when you need to compare discrete values or counts for different categories or for showing distributions of values or frequencies.\n"
+                      "       - Use 'line_chart' when you need to show the trends or changes over a continuous variable (e.g., over time) or to see the relationships between two continuous numerical variables.\n"
+                      "       - Use 'pie_chart' when you want to show proportional data or percentage contribution for different categories.\n"
+                      "       - Use 'scatter_plot' when you want to show the relation between two continuous numerical columns and want to see patterns in the data.\n"
+                      "   11. The summary should be concise, informative and should also include the chart type, x-axis, y-axis, and group by column(if any) to display the visualization parameters.\n"
+                      f"   12. If the user question can be answered without querying the `{table_name}`, return the answer directly as a string.\n"
+                      "   13. If there is an error during executing SQL query, then make sure to display the error message as the final output. Do not show anything else."
+
+            )
+        ),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ("user", "{input}")
+    ])
 
 
 
 # -------------------- Species Observation Map --------------------
-@st.cache_resource
-def generate_map(df):
-    """Generates and displays a map of Tamil Nadu state in India with mammal occurrences."""
+# Conservation statuses from the most to the least threatened: a marker takes the color of its most threatened status.
+CONSERVATION_COLORS = {
+    'Endangered': 'red',
+    'Vulnerable': 'orange',
+    'Near Threatened': 'yellow',
+    'Least Concern': 'green',
+}
+MAP_DETAIL_LEVELS = {"overview": 8, "region": 10, "local": 12, "points": 13} # Map zoom per detail level
+
+
+@st.cache_data(max_entries=MAX_RESIDENT_DATASETS * len(MAP_DETAIL_LEVELS))
+def load_map_layer(db_path: str, level: str, table_name: str = TABLE_NAME) -> pd.DataFrame:
+    """Returns the markers of a map detail level, read once per dataset version (the store path holds its hash)."""
+    return read_map_layer(db_path, level, table_name)
+
+
+def build_map_figure(df: pd.DataFrame, level: str = "overview", taxa: str = "Mammals") -> "go.Figure | None":
+    """Builds the map of Tamil Nadu state in India with mammal occurrences (`None` when there is nothing to plot).
+
+        Markers are grid cells (or observed locations at the "points" level) drawn as a single trace, sized by
+        their number of observations, with the per conservation status counts in the tooltips.
+    """
+    if df.empty:
+        return None
+    import plotly.graph_objects as go
+
+    statuses = [status for status in CONSERVATION_COLORS if status in df.columns]
+    # Color of the most threatened status observed in each marker
+    marker_color = pd.Series('gray', index=df.index)
+    for status in reversed(statuses):
+        marker_color = marker_color.mask(df[status] > 0, CONSERVATION_COLORS[status])
+
+    hover_text = df["label"]
+    for status in statuses:
+        hover_text = hover_text + f"<br>{status}: " + df[status].astype(str)
+    marker_size = 10 if level == "points" else np.clip(6 + 4 * np.sqrt(df["observations"]), 8, 40)
+
+    fig = go.Figure(go.Scattermap(
+        lat = df["decimalLatitude"],
+        lon = df["decimalLongitude"],
+        mode = 'markers',
+        marker = go.scattermap.Marker(
+            size=marker_size,
+            color=marker_color,
+            opacity=0.7
+        ),
+        text = hover_text,
+        hoverinfo = 'text'
+    ))
+
+    fig.update_layout(
+        title=dict(text=f'{taxa} Occurrences in Tamil Nadu (based on Conservation Status: 🟢 Least Concern, 🟡 Near Threatened, 🟠 Vulnerable, 🔴 Endangered)'),
+        autosize=True,
+        hovermode='closest',
+        showlegend=False,
+        map=dict(
+              style = "light",
+              center=dict(
+                lat=float(np.average(df["decimalLatitude"], weights=df["observations"])),
+                lon=float(np.average(df["decimalLongitude"], weights=df["observations"]))
+                  ),
+              zoom=MAP_DETAIL_LEVELS.get(level, 8),
+               bearing=0,
+               pitch=0
+               )
+    )
+    return fig
+
+
+def generate_map(data_path: str, dataset_version: str, db_path: str, level: str = "overview"):
+    """Displays the species observation map, built once per dataset version & detail level (see `figure_cache.py`)."""
+    table_name = table_name_for(data_path)
     try:
-        # Create a copy of the original data frame so that we can apply some filtering if required.
-        df_copy = df.copy()
-        if "decimalLatitude" not in df_copy.columns or "decimalLongitude" not in df_copy.columns:
-           st.error("Latitude or longitude columns not found in the dataframe.")
-           return
-
-        # Define a color mapping for conservation statuses
-        conservation_colors = {
-            'Least Concern': 'green',
-            'Near Threatened': 'yellow',
-            'Vulnerable': 'orange',
-            'Endangered': 'red',
-        }
-        # Map conservation statuses to colors
-        df_copy['marker_color'] = df_copy['conservationStatus'].map(conservation_colors)
-        
-        fig = go.Figure()
-        
-        fig.add_trace(go.Scattermap(
-            lat = df_copy["decimalLatitude"],
-            lon = df_copy["decimalLongitude"],
-            mode = 'markers',
-            marker = go.scattermap.Marker(
-                size=4,
-                color='black'
-            ),
-           text = df_copy["place"],
-           hoverinfo = 'text'
-        ))
-        fig.add_trace(go.Scattermap(
-            lat = df_copy["decimalLatitude"],
-            lon = df_copy["decimalLongitude"],
-            mode = 'markers',
-            marker = go.scattermap.Marker(
-                size=10,
-                color=df_copy['marker_color'],
-                opacity=0.7
-            ),
-            text = df_copy['speciesName']+ '<br>' + df_copy['place'],
-            hoverinfo = 'text'
-        ))
-
-        fig.update_layout(
-            title=dict(text='Mammal Occurrences in Tamil Nadu (based on Conservation Status: 🟢 Least Concern, 🟡 Near Threatened, 🟠 Vulnerable, 🔴 Endangered)'),
-            autosize=True,
-            hovermode='closest',
-            showlegend=False,
-            map=dict(
-                  style = "light",
-                  center=dict(
-                    lat=10.2916, #11.059821
-                    lon=77.4912  # 78.387451
-                      ),
-                  zoom=8,
-                   bearing=0,
-                   pitch=0
-                   )
-        )
+        fig = figure_cache.get_or_build(data_path, dataset_version, "map", {"level": level},
+                                        lambda: build_map_figure(load_map_layer(db_path, level, table_name), level, dataset_label(data_path)))
+        if fig is None:
+            st.info("No observations to display on the map.")
+            return
         st.plotly_chart(fig)
     except Exception as e:
         st.error(f"Error generating the map: {e}")
@@ -140,11 +199,53 @@ def generate_map(df):
 
 
 # ---------- Function to load data ----------
-@st.cache_data
-def load_and_preprocess_data(data_path:str) -> pd.DataFrame:
-    """Loads, preprocesses, and returns the merged dataframe."""
+def _frame_memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 1024 ** 2
+
+
+@st.cache_data(max_entries=MAX_RESIDENT_DATASETS)
+def load_dataset_summary(db_path: str, table_name: str = TABLE_NAME) -> dict:
+    """Returns the column names, row count and filter options of the dataset, computed in the query store."""
+    return summarise_store(db_path, table_name)
+
+
+@st.cache_data(max_entries=MAX_RESIDENT_DATASETS) # Only the most recently used datasets stay in memory
+def load_and_preprocess_data(data_path:str, dataset_version: str | None = None, streaming: bool = False) -> pd.DataFrame | dict:
+    """Loads, preprocesses (typed columns), and returns the merged dataframe.
+
+        A typed Parquet sidecar keyed by the CSV content hash is written on the first load, so cold starts
+        read it instead of re-parsing the CSV. `dataset_version` only serves as cache key for Streamlit.
+
+        In streaming mode the CSV is read in chunks that are validated, normalised and appended directly into
+        the query store; only the dataset summary (see `load_dataset_summary`) is returned and kept in memory.
+    """
     try:
-        mammals_df = pd.read_csv(data_path)
+        if streaming:
+            db_path = get_query_store(data_path, chunksize=STREAM_CHUNKSIZE)
+            return load_dataset_summary(db_path, table_name_for(data_path))
+
+        os.makedirs(STORE_DIR, exist_ok=True)
+        parquet_path = store_path_for(data_path, dataset_version or file_content_hash(data_path), suffix="parquet")
+        if os.path.exists(parquet_path):
+            try:
+                with trace_stage("data_load", source="parquet"):
+                    mammals_df = pd.read_parquet(parquet_path)
+                logging.info(f"Loaded typed cache {parquet_path} ({_frame_memory_mb(mammals_df):.2f} MB in memory)")
+                return mammals_df
+            except Exception as e:
+                logging.warning(f"Could not read the Parquet cache, re-parsing the CSV: {e}")
+
+        with trace_stage("data_load", source="csv"):
+            mammals_df = pd.read_csv(data_path)
+            memory_before = _frame_memory_mb(mammals_df)
+            mammals_df = apply_column_types(mammals_df)
+        logging.info(f"Typed ingest of {data_path}: {memory_before:.2f} MB -> {_frame_memory_mb(mammals_df):.2f} MB in memory")
+
+        try:
+            mammals_df.to_parquet(parquet_path, index=False)
+            remove_stale_artifacts(data_path, keep=parquet_path)
+        except ImportError as e:
+            logging.warning(f"Parquet engine not installed, skipping the typed cache: {e}")
         return mammals_df
     except Exception as e:
         print (f"Error loading data:{e}")
@@ -153,16 +254,73 @@ def load_and_preprocess_data(data_path:str) -> pd.DataFrame:
 
 
 # ---------- Function to execute SQL queries using SQLite ----------
-def execute_sql_query(sql_query: dict | str, mammals_df: pd.DataFrame) -> dict[str, Any]:
-    """Executes a SQL query on the loaded dataframe using SQLite, filters data based on query, and returns the results as a list of dicts.
+# Tool results are bounded: the LLM gets a preview, the row count and column statistics, plus a handle to fetch more.
+PREVIEW_ROWS = 20
+MAX_PAGE_ROWS = 100
+
+
+def _is_select_query(query_str: str) -> bool:
+    return "select" in query_str.lower() and "from" in query_str.lower()
+
+
+_SQL_LITERALS_AND_COMMENTS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def _is_single_statement(query_str: str) -> bool:
+    """Whether the query has no `;` outside of string literals, quoted names and comments (besides a trailing one)."""
+    return ";" not in _SQL_LITERALS_AND_COMMENTS.sub(" ", query_str).strip().rstrip(";")
+
+
+def _bounded_result(engine: QueryEngine, query_str: str, max_rows: int) -> tuple[list[str], list[tuple], dict]:
+    """Returns the first `max_rows` rows of the query with its row count & column statistics, reusing the results
+    of an equivalent query (same canonical SQL & dataset version) if available."""
+    cached_result = result_cache.get(engine, query_str)
+    if cached_result is not None:
+        column_names, rows, meta = cached_result
+        if len(rows) >= min(max_rows, meta["row_count"]):
+            logging.info(f"Result cache hit ({result_cache.stats()})")
+            count("zoogist_cache_requests_total", cache="sql_result", result="hit")
+            return column_names, rows[:max_rows], meta
+
+    # Execute the SQL query on the selected engine, streaming through the rows beyond the preview
+    count("zoogist_cache_requests_total", cache="sql_result", result="miss")
+    with trace_stage("sql", engine=engine.name):
+        column_names, rows, meta = run_bounded_query(engine, query_str, max_rows)
+    count("zoogist_sql_rows_total", meta["row_count"], engine=engine.name)
+    result_cache.put(engine, query_str, column_names, rows, meta)
+    return column_names, rows, meta
+
+
+def _format_bounded_result(column_names: list[str], rows: list[tuple], meta: dict, result_handle: str, offset: int = 0) -> dict[str, Any]:
+    if not rows:
+        return {"sql_query_result": None, "message": "No records found based on your query."}
+
+    # Convert the rows to a list of dictionaries
+    formatted_results = [dict(zip(column_names, row)) for row in rows]
+    row_count = meta["row_count"]
+    message = "Query successful"
+    if len(rows) < row_count:
+        message += (f" (showing rows {offset + 1}-{offset + len(rows)} of {row_count}; call `fetch_query_results` "
+                    f"with the `result_handle` for more rows or aggregates)")
+    return {
+        "sql_query_result": formatted_results,
+        "row_count": row_count,
+        "column_stats": dict(zip(column_names, meta["column_stats"])),
+        "result_handle": result_handle,
+        "message": message,
+    }
+
+
+def execute_sql_query(sql_query: dict | str, engine: QueryEngine) -> dict[str, Any]:
+    """Executes a SQL query on the configured query engine (SQLite store or DuckDB), filters data based on query, and returns a bounded preview of the results.
     
         Args:
             sql_query: A dict containing the SQL query (e.g., {"sql_query":"SELECT species FROM mammals_df"})
-            mammals_df: The dataframe on which to execute the query
+            engine: The query engine created by `load_query_engine`
 
             Returns:
             A dictionary containing the query results, or an error message. The dictionary format is:
-            - On success: {"sql_query_result": List[dict], "message": "Query Successful"}
+            - On success: {"sql_query_result": List[dict] (first `PREVIEW_ROWS` rows), "row_count": int, "column_stats": dict,
+                           "result_handle": str, "message": "Query Successful"}
             - On error: {"sql_query_result": None, "message": "Error message string"}
     
     """
@@ -178,35 +336,19 @@ def execute_sql_query(sql_query: dict | str, mammals_df: pd.DataFrame) -> dict[s
           logging.error (f"Invalid sql query: {sql_query}")
           return {"sql_query_result": None, "message": "Error: Invalid input for SQL query. Must be string or dictionary"}
 
-        query_str = query_str.strip()
+        query_str = query_str.strip().rstrip(";").strip()
 
-        if "select" not in query_str.lower() or "from" not in query_str.lower():
+        if not _is_select_query(query_str):
             logging.error(f"Invalid SQL query. Must contain SELECT and FROM keywords: {query_str}")
             return {"sql_query_result": None, "message": "Error: Invalid SQL query. Must contain SELECT and FROM keywords."}
-        logging.info(f"Executing SQL query: {query_str}")
-
-        # Convert pandas DataFrame to an SQLite database
-        conn = sqlite3.connect(':memory:')
-        mammals_df.to_sql('mammals_df', conn, if_exists='replace', index=False)
-
-        # Execute the SQL query using SQLite
-        cursor = conn.cursor()
-        cursor.execute(query_str)
+        if not _is_single_statement(query_str):
+            logging.error(f"Invalid SQL query. Must be a single statement: {query_str}")
+            return {"sql_query_result": None, "message": "Error: Invalid SQL query. Only a single SELECT statement can be executed."}
+        logging.info(f"Executing SQL query ({engine.name}): {query_str}")
 
-        # Fetch column names and results
-        column_names = [desc[0] for desc in cursor.description]
-        query_results = cursor.fetchall()
-
-        conn.close()
-
-         # Convert the results to a list of dictionaries
-        formatted_results = [dict(zip(column_names, row)) for row in query_results]
-        logging.info("Query executed successfully.")
-
-        if not formatted_results:
-            return {"sql_query_result": None, "message": "No records found based on your query."}
-
-        return {"sql_query_result": formatted_results, "message": "Query successful"}
+        column_names, rows, meta = _bounded_result(engine, query_str, PREVIEW_ROWS)
+        logging.info(f"Query executed successfully ({meta['row_count']} rows).")
+        return _format_bounded_result(column_names, rows, meta, result_handles.register(engine, query_str))
 
     except sqlite3.Error as e:
         logging.error(f"Database error: {e}")
@@ -216,26 +358,362 @@ def execute_sql_query(sql_query: dict | str, mammals_df: pd.DataFrame) -> dict[s
       return {"sql_query_result": None, "message": f"Error executing SQL query: {str(e)}"}
 
 
+def fetch_query_results(request: dict | str) -> dict[str, Any]:
+    """Fetches another page, or an aggregate, of a result previously returned by `execute_sql_query`.
+
+        Args:
+            request: A dict (or its JSON string) with the `result_handle` and either `offset`/`limit` for a page of rows,
+                or `aggregate_sql`, a query over the table `result` (e.g. "SELECT habitat, COUNT(*) AS n FROM result GROUP BY habitat").
+                A bare handle string fetches the rows following the preview.
+    """
+    try:
+        if isinstance(request, str):
+            request = request.strip()
+            request = json.loads(request) if request.startswith("{") else {"result_handle": request}
+        if not isinstance(request, dict) or not request.get("result_handle"):
+            return {"sql_query_result": None, "message": "Error: A `result_handle` returned by `execute_sql_query` is required."}
+
+        resolved = result_handles.resolve(request["result_handle"])
+        if resolved is None:
+            return {"sql_query_result": None, "message": "Error: Unknown or expired result handle. Run the SQL query again with `execute_sql_query`."}
+        engine, query_str = resolved
+
+        aggregate_sql = (request.get("aggregate_sql") or "").strip().rstrip(";").strip()
+        if aggregate_sql:
+            if not _is_select_query(aggregate_sql):
+                return {"sql_query_result": None, "message": "Error: Invalid aggregate query. Must contain SELECT and FROM keywords."}
+            if not _is_single_statement(aggregate_sql):
+                return {"sql_query_result": None, "message": "Error: Invalid aggregate query. Only a single SELECT statement can be executed."}
+            aggregate_sql = f"WITH result AS ({query_str}) {aggregate_sql}"
+            logging.info(f"Aggregating result {request['result_handle']} ({engine.name}): {aggregate_sql}")
+            column_names, rows, meta = _bounded_result(engine, aggregate_sql, MAX_PAGE_ROWS)
+            return _format_bounded_result(column_names, rows, meta, result_handles.register(engine, aggregate_sql))
+
+        offset = max(int(request.get("offset", PREVIEW_ROWS)), 0)
+        limit = min(max(int(request.get("limit", PREVIEW_ROWS)), 1), MAX_PAGE_ROWS)
+        page_sql = f"SELECT * FROM ({query_str}) LIMIT {limit} OFFSET {offset}"
+        logging.info(f"Fetching rows {offset + 1}-{offset + limit} of result {request['result_handle']} ({engine.name})")
+        column_names, rows, meta = _bounded_result(engine, page_sql, limit)
+        _, _, result_meta = _bounded_result(engine, query_str, PREVIEW_ROWS) # Row count of the full result (usually cached)
+        page = _format_bounded_result(column_names, rows, {**meta, "row_count": result_meta["row_count"]}, request["result_handle"], offset)
+        page.pop("column_stats", None) # Statistics of a single page are not meaningful
+        page["offset"] = offset
+        return page
+
+    except (ValueError, TypeError) as e:
+        return {"sql_query_result": None, "message": f"Error: Invalid request for `fetch_query_results`: {e}"}
+    except Exception as e:
+        logging.error(f"Error fetching query results: {str(e)}")
+        return {"sql_query_result": None, "message": f"Error fetching query results: {str(e)}"}
+
+
+
+# ---------- Chart data (filtered & aggregated in the query engine) ----------
+CHART_MAX_SCATTER_POINTS = 5000
+CHART_MAX_LINE_POINTS = 1000
+
+
+def _sql_literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _chart_column(col: str) -> tuple[str, str]:
+    """Returns the SQL expression and output name of a chart column (`date` is plotted by year)."""
+    if col == "date":
+        return "CAST(strftime('%Y', \"date\") AS INTEGER)", "year"
+    return f'"{col}"', col
+
+
+def lttb_downsample(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling of a line; returns the indices of the points to keep."""
+    n_points = len(x)
+    if threshold >= n_points or threshold < 3:
+        return np.arange(n_points)
+
+    kept = [0]
+    bucket_size = (n_points - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = int(bucket * bucket_size) + 1, int((bucket + 1) * bucket_size) + 1
+        next_start, next_end = end, min(int((bucket + 2) * bucket_size) + 1, n_points)
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Keeps the point of the bucket forming the largest triangle with the previous kept point & the next bucket's average
+        areas = np.abs((x[previous] - avg_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (avg_y - y[previous]))
+        previous = start + int(areas.argmax())
+        kept.append(previous)
+    kept.append(n_points - 1)
+    return np.array(kept)
+
+
+def load_chart_data(engine: QueryEngine, x_axis_col: str, y_axis_col: str, chart_type: str, color_col: str | None,
+                    filter_selected_options: dict[str, list]) -> tuple[pd.DataFrame, str, str]:
+    """Builds the data of a sidebar chart in the query engine instead of pandas.
+
+        Bar, pie and line charts are aggregated per x (and color) group: sum of `count`, mean of the other numeric
+        columns, number of observations otherwise. Scatter plots keep the raw points, sampled down to
+        `CHART_MAX_SCATTER_POINTS`, and line charts are downsampled with LTTB to `CHART_MAX_LINE_POINTS`.
+
+        Returns:
+            The chart data and the names of its x and y columns.
+    """
+    conditions = [f'"{col}" IN ({", ".join(_sql_literal(v) for v in values)})' for col, values in filter_selected_options.items() if values]
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    x_expr, x_name = _chart_column(x_axis_col)
+    y_expr, y_name = _chart_column(y_axis_col)
+    group_cols = [(x_expr, x_name)]
+    if color_col and chart_type == "bar_chart" and color_col not in (x_axis_col, y_axis_col):
+        group_cols.append(_chart_column(color_col))
+
+    if chart_type == "scatter_plot":
+        select_cols = [(x_expr, x_name), (y_expr, y_name)]
+        if color_col and color_col not in (x_axis_col, y_axis_col):
+            select_cols.append(_chart_column(color_col))
+        select = ", ".join(f'{expr} AS "{name}"' for expr, name in dict(select_cols).items())
+        cursor = engine.execute(f'SELECT COUNT(*) FROM "{engine.table_name}"{where}')
+        total_points = cursor.fetchone()[0]
+        cursor.close()
+        sample = f" ORDER BY RANDOM() LIMIT {CHART_MAX_SCATTER_POINTS}" if total_points > CHART_MAX_SCATTER_POINTS else ""
+        query_str = f'SELECT {select} FROM "{engine.table_name}"{where}{sample}'
+    else:
+        if COLUMN_TYPES.get(y_axis_col) in ("INTEGER", "FLOAT"):
+            aggregate = "SUM" if y_axis_col == "count" else "AVG"
+            y_name = f"{'sum' if aggregate == 'SUM' else 'mean'}_{y_axis_col}"
+            y_expr = f'{aggregate}({y_expr})'
+        else:
+            y_name, y_expr = "observations", "COUNT(*)"
+        group_by = ", ".join(expr for expr, _ in group_cols)
+        select = ", ".join(f'{expr} AS "{name}"' for expr, name in group_cols)
+        query_str = f'SELECT {select}, {y_expr} AS "{y_name}" FROM "{engine.table_name}"{where} GROUP BY {group_by} ORDER BY {group_by}'
+
+    cursor = engine.execute(query_str)
+    chart_df = pd.DataFrame(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
+    cursor.close()
+
+    if chart_type == "line_chart" and len(chart_df) > CHART_MAX_LINE_POINTS:
+        x_values = chart_df[x_name].to_numpy(dtype=float) if pd.api.types.is_numeric_dtype(chart_df[x_name]) else np.arange(len(chart_df), dtype=float)
+        chart_df = chart_df.iloc[lttb_downsample(x_values, chart_df[y_name].to_numpy(dtype=float), CHART_MAX_LINE_POINTS)]
+    return chart_df, x_name, y_name
+
+
+
+# ---------- Function to load the query engine ----------
+@st.cache_resource(max_entries=MAX_RESIDENT_DATASETS)
+def load_query_engine(db_path: str, _mammals_df: pd.DataFrame, engine_name: str = QUERY_ENGINE, table_name: str = TABLE_NAME) -> QueryEngine:
+    """Creates the query engine once per dataset version (`db_path` changes with the CSV contents)."""
+    return create_query_engine(db_path, _mammals_df, engine_name, table_name)
+
+
 
 # ---------- Function to create and execute the LangChain agent ----------
-@st.cache_resource
-def create_and_run_agent(mammals_df: pd.DataFrame, _prompt):
+# Engines are identified by their name & dataset version rather than hashed by content.
+ENGINE_HASH_FUNCS = {engine_cls: lambda engine: engine.cache_key for engine_cls in (SQLiteEngine, DuckDBEngine)}
+
+@st.cache_resource(hash_funcs=ENGINE_HASH_FUNCS, max_entries=MAX_RESIDENT_DATASETS) # One agent per dataset
+def create_and_run_agent(engine: QueryEngine, _prompt, llm_provider: str | None = None):
+    """Builds the agent of a dataset (with the `ZOOGIST_LLM_PROVIDER` LLM by default). Called on the first question, not at startup."""
+    from langchain_core.tools import Tool
+    from langchain.agents import create_openai_tools_agent, AgentExecutor
+    from llm_providers import create_llm
+
+    runner = get_agent_runner()
+
     # Define Tools
     tools = [
         Tool(
             name="execute_sql_query",
-            func=lambda query: execute_sql_query(query, mammals_df),
-            description="Executes a SQL-like query on the dataframe. The input should be a valid SQL query string and outputs results of the query and message. ",
-        )
+            func=lambda query: execute_sql_query(query, engine),
+            coroutine=lambda query: runner.run_in_thread(execute_sql_query, query, engine), # SQL runs in the runner's thread pool
+            description="Executes a SQL-like query on the dataframe. The input should be a valid SQL query string and outputs a preview of the results (at most 20 rows), the total row count, column statistics, a result handle and message. ",
+        ),
+        Tool(
+            name="fetch_query_results",
+            func=fetch_query_results,
+            coroutine=lambda request: runner.run_in_thread(fetch_query_results, request),
+            description=(
+                "Fetches more rows or aggregates of a previous `execute_sql_query` result. The input should be a JSON string with the "
+                "`result_handle` and either `offset` and `limit` (at most 100 rows), e.g. {\"result_handle\": \"res_1a2b3c4d5e\", \"offset\": 20, \"limit\": 50}, "
+                "or an `aggregate_sql` query over the table `result`, e.g. {\"result_handle\": \"res_1a2b3c4d5e\", \"aggregate_sql\": \"SELECT habitat, COUNT(*) AS n FROM result GROUP BY habitat\"}."
+            ),
+        ),
     ]
 
-    # Initialize ChatGroq LLM
-    llm = ChatGroq(model_name="llama-3.1-8b-instant")
+    # Initialize the LLM (ChatGroq, or the offline scripted stand-in)
+    llm = create_llm(llm_provider) if llm_provider else create_llm()
 
     # Create agent
     agent = create_openai_tools_agent(llm=llm, tools=tools, prompt=_prompt)
 
     # Run agent
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True) # , max_iterations=10 - Set max iterations here to avoid LLM loops
+    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, return_intermediate_steps=True) # , max_iterations=10 - Set max iterations here to avoid LLM loops
+
+    return agent_executor
+
 
-    return agent_executor
\ No newline at end of file
+
+# ---------- Semantic cache of agent responses ----------
+@st.cache_resource(max_entries=MAX_RESIDENT_DATASETS)
+def load_query_cache(data_path: str, dataset_version: str) -> QueryCache:
+    """Returns the query cache shared by all sessions, invalidated whenever the dataset version changes."""
+    query_cache = _query_cache_for(data_path)
+    query_cache.ensure_version(dataset_version)
+    return query_cache
+
+
+@st.cache_resource(max_entries=MAX_RESIDENT_DATASETS)
+def _query_cache_for(data_path: str) -> QueryCache:
+    return QueryCache(data_path)
+
+
+@st.cache_resource
+def get_agent_runner() -> AgentRunner:
+    """Returns the runner executing agent jobs for all sessions (bounded queue, per-session limits & timeouts)."""
+    return AgentRunner()
+
+
+async def _astream_agent(agent_executor, question: str, events: queue.Queue) -> dict:
+    """Runs the agent through its event stream, forwarding the intermediate steps & answer tokens to `events`:
+    ("sql", query), ("sql_result", {"row_count", "message", "seconds"}), ("token", text) and ("llm_start", None)."""
+    response, tool_starts = None, {}
+    async for event in agent_executor.astream_events({"input": question}, config={"callbacks": agent_callbacks()}, version="v2"):
+        kind, data = event["event"], event["data"]
+        if kind == "on_chain_stream" and not event["parent_ids"]:
+            for action in data["chunk"].get("actions", []):
+                if action.tool == "execute_sql_query":
+                    events.put(("sql", action.tool_input.get("sql_query", action.tool_input) if isinstance(action.tool_input, dict) else action.tool_input))
+        elif kind == "on_tool_start":
+            tool_starts[event["run_id"]] = time.perf_counter()
+        elif kind == "on_tool_end" and event["run_id"] in tool_starts:
+            output = data.get("output")
+            output = output if isinstance(output, dict) else {}
+            events.put(("sql_result", {
+                "tool": event["name"],
+                "row_count": output.get("row_count", 0 if output.get("sql_query_result") is None else len(output["sql_query_result"])),
+                "message": output.get("message"),
+                "seconds": time.perf_counter() - tool_starts.pop(event["run_id"]),
+            }))
+        elif kind == "on_chat_model_start":
+            events.put(("llm_start", None))
+        elif kind == "on_chat_model_stream" and isinstance(data["chunk"].content, str) and data["chunk"].content:
+            events.put(("token", data["chunk"].content))
+        elif kind == "on_chain_end" and not event["parent_ids"]:
+            response = data["output"]
+    return response
+
+
+async def arun_agent_query(agent_executor, query_cache: QueryCache, question: str, events: queue.Queue | None = None) -> dict:
+    """Answers the question from the query cache when possible, otherwise runs the agent and caches its response.
+
+        When an `events` queue is given, the agent's intermediate steps and answer tokens are streamed into it.
+    """
+    response = query_cache.get(question)
+    count("zoogist_cache_requests_total", cache="query", result="miss" if response is None else "hit")
+    if response is None:
+        with trace_stage("agent_run"):
+            if events is None:
+                response = await agent_executor.ainvoke({"input": question}, config={"callbacks": agent_callbacks()})
+            else:
+                response = await _astream_agent(agent_executor, question, events)
+        if is_cacheable(response):
+            query_cache.put(question, response)
+    elif events is not None:
+        events.put(("cached", response.get("cache_match")))
+    return response
+
+
+def submit_agent_query(agent_executor, query_cache: QueryCache, question: str, session_id: str,
+                       events: queue.Queue | None = None) -> concurrent.futures.Future:
+    """Schedules the question on the agent runner and returns a future of the agent response.
+
+        A new question cancels the job still running for the session; the same question attaches to it
+        (its events then keep flowing to the queue of the first submission).
+    """
+    job_key = f"{query_cache.data_path}:{normalise_question(question)}"
+    return get_agent_runner().submit(session_id, job_key, lambda: arun_agent_query(agent_executor, query_cache, question, events))
+
+
+_JSON_ANSWER_KEY = re.compile(r'"(summary|answer)"\s*:\s*"')
+_JSON_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_JSON_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+
+
+def _unicode_escape(text: str, i: int) -> int | None:
+    """Code point of the `\\uXXXX` escape at `text[i]`, `None` when it is incomplete or malformed."""
+    match = _JSON_HEX4.match(text, i + 2) if text.startswith("\\u", i) else None
+    return int(match.group(), 16) if match else None
+
+
+def extract_partial_answer(text: str) -> str | None:
+    """Extracts the (possibly incomplete) `summary`/`answer` value from a partially streamed JSON output.
+
+        Plain-text outputs are returned as they are; `None` means no answer text is available yet.
+    """
+    stripped = text.lstrip()
+    if not stripped:
+        return None
+    if not stripped.startswith(("{", "```")):
+        return text
+    match = _JSON_ANSWER_KEY.search(text)
+    if match is None:
+        return None
+
+    chars, i = [], match.end()
+    while i < len(text):
+        char = text[i]
+        if char == '"':
+            break
+        if char == "\\":
+            if i + 1 >= len(text):
+                break # Escape sequence split across tokens
+            escaped = text[i + 1]
+            if escaped == "u":
+                # Incomplete & malformed escapes end the partial answer, the final output is parsed strictly
+                code = _unicode_escape(text, i)
+                if code is None or 0xDC00 <= code <= 0xDFFF:
+                    break
+                i += 6
+                if 0xD800 <= code <= 0xDBFF: # Characters outside the BMP are escaped as a surrogate pair
+                    low = _unicode_escape(text, i)
+                    if low is None or not 0xDC00 <= low <= 0xDFFF:
+                        break
+                    code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                    i += 6
+                chars.append(chr(code))
+                continue
+            chars.append(_JSON_ESCAPES.get(escaped, escaped))
+            i += 2
+            continue
+        chars.append(char)
+        i += 1
+    return "".join(chars)
+
+
+def prewarm_query_cache(get_agent: Callable, query_cache: QueryCache, questions: list[str]):
+    """Runs the agent for the (demo) questions missing from the cache in the background.
+
+        The agent is only built (with `get_agent()`, in the runner's thread pool) when some questions are missing.
+    """
+    if query_cache.prewarmed:
+        return
+    query_cache.prewarmed = True
+    missing = [question for question in questions if question not in query_cache]
+    if not missing:
+        return
+
+    runner = get_agent_runner()
+
+    async def _prewarm():
+        try:
+            # Importing LangChain & building the agent would otherwise block the runner's event loop (and every session's jobs)
+            agent_executor = await runner.run_in_thread(get_agent)
+        except Exception as e:
+            logging.warning(f"Could not build the agent to pre-warm the query cache: {e}")
+            return
+        for question in missing:
+            try:
+                await arun_agent_query(agent_executor, query_cache, question)
+            except Exception as e:
+                logging.warning(f"Could not pre-warm the query cache for {question!r}: {e}")
+        logging.info(f"Query cache pre-warmed with {len(missing)} questions.")
+
+    # Pre-warming is a single background job, so it takes only one run slot of the runner.
+    runner.submit_background(_prewarm)